@@ -1,13 +1,18 @@
-from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi.responses import HTMLResponse, FileResponse, Response, StreamingResponse
+from email.utils import formatdate, parsedate_to_datetime
+from functools import lru_cache
+import hashlib
 import sys
 import os
 import asyncio
 import json
 import logging
+import re
+import time
 from pathlib import Path
-from threading import Thread
-from queue import Queue
+from threading import Thread, Lock
+from queue import Queue, Empty
 from datetime import datetime
 
 # Configure logging
@@ -23,7 +28,8 @@ logger = logging.getLogger(__name__)
 
 # Add parent directory to path to import MCP client
 sys.path.append(str(Path(__file__).parent))
-from client.mcp_client import MCPClient
+from client.mcp_client import MCPClient, CancelToken, PipelineCancelled, VIDEO_ID_PATTERN
+from server.wire import preferred
 
 app = FastAPI(title="YouTube Blog Chatbot")
 
@@ -31,6 +37,9 @@ app = FastAPI(title="YouTube Blog Chatbot")
 MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "http://localhost:8000")
 mcp_client = MCPClient(MCP_SERVER_URL)
 
+# Must point at the same (shared) directory the MCP server workers export into
+OUTPUTS_DIR = os.path.abspath(os.getenv("MCP_OUTPUTS_DIR", os.path.join(os.path.dirname(__file__), "server", "outputs")))
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     """Serve the chatbot interface"""
@@ -216,6 +225,11 @@ async def read_root(request: Request):
             box-shadow: 0 5px 15px rgba(102, 126, 234, 0.4);
         }
         
+        .cancel-button {
+            display: none;
+            background: #dc3545;
+        }
+        
         .send-button:disabled {
             opacity: 0.6;
             cursor: not-allowed;
@@ -329,6 +343,7 @@ async def read_root(request: Request):
                     autocomplete="off"
                 />
                 <button type="submit" class="send-button" id="sendButton">Send</button>
+                <button type="button" class="send-button cancel-button" id="cancelButton" onclick="cancelRequest()">Cancel</button>
             </form>
         </div>
     </div>
@@ -341,6 +356,7 @@ async def read_root(request: Request):
         const chatMessages = document.getElementById('chatMessages');
         const messageInput = document.getElementById('messageInput');
         const sendButton = document.getElementById('sendButton');
+        const cancelButton = document.getElementById('cancelButton');
         const chatForm = document.getElementById('chatForm');
         
         function setExample(text) {
@@ -368,6 +384,16 @@ async def read_root(request: Request):
             return messageContent;
         }
         
+        function setRunning(running) {
+            sendButton.disabled = running;
+            cancelButton.style.display = running ? 'inline-block' : 'none';
+        }
+        
+        function cancelRequest() {
+            cancelButton.disabled = true;
+            ws.send(JSON.stringify({ type: 'cancel' }));
+        }
+        
         function sendMessage(event) {
             event.preventDefault();
             const message = messageInput.value.trim();
@@ -376,7 +402,8 @@ async def read_root(request: Request):
             // Add user message
             addMessage(message, 'user');
             messageInput.value = '';
-            sendButton.disabled = true;
+            setRunning(true);
+            cancelButton.disabled = false;
             
             // Add loading message
             const progressMsg = addMessage('<span class="loading"></span> Processing your request...', 'assistant', 'progress');
@@ -436,14 +463,21 @@ async def read_root(request: Request):
                 }
                 
                 addMessage(resultHtml, 'assistant', 'success');
-                sendButton.disabled = false;
+                setRunning(false);
             } else if (data.type === 'error') {
                 // Remove progress messages
                 const progressMessages = chatMessages.querySelectorAll('.message-content.progress');
                 progressMessages.forEach(msg => msg.parentElement.remove());
                 
                 addMessage(`<strong>❌ Error:</strong> ${escapeHtml(data.message)}`, 'assistant', 'error');
-                sendButton.disabled = false;
+                setRunning(false);
+            } else if (data.type === 'cancelled') {
+                // Remove progress messages
+                const progressMessages = chatMessages.querySelectorAll('.message-content.progress');
+                progressMessages.forEach(msg => msg.parentElement.remove());
+                
+                addMessage(`<strong>⏹ Cancelled:</strong> ${escapeHtml(data.message)}`, 'assistant');
+                setRunning(false);
             }
             
             chatMessages.scrollTop = chatMessages.scrollHeight;
@@ -456,7 +490,7 @@ async def read_root(request: Request):
         ws.onerror = function(error) {
             console.error('WebSocket error:', error);
             addMessage('<strong>Connection Error:</strong> Could not connect to server. Make sure the chatbot server is running on port 8080.', 'assistant', 'error');
-            sendButton.disabled = false;
+            setRunning(false);
         };
         
         ws.onclose = function(event) {
@@ -480,6 +514,203 @@ async def read_root(request: Request):
     """
     return html_content
 
+# Overall budget for one pipeline run; the run is cancelled when it is exceeded
+PIPELINE_TIMEOUT_SECONDS = 600
+
+# Requests for the same video, tone and options share one pipeline run
+VIDEO_URL_PATTERN = re.compile(r"\S*(?:youtube\.com|youtu\.be)/\S*")
+TONES = {"educational", "casual", "professional", "technical", "formal", "friendly", "conversational", "humorous"}
+OPTION_TRIGGERS = {"diagram": ("diagram", "flowchart", "architecture")}
+FILLER_WORDS = set("""
+a an the and or to in into of for from on with this that these my me i you can could please would like want
+need make create generate write produce turn convert give blog post article document video youtube tone style
+using use based it its some nice good
+""".split())
+
+def pipeline_key(user_message: str):
+    """
+    Coalescing key (video id, tone, options, remaining instructions) for a chat message.
+
+    Wording that does not change the plan (filler words, the URL form) is
+    ignored; anything else the user asked for stays in the key, so requests
+    with different instructions never share a run. None when no video is named.
+    """
+    match = VIDEO_ID_PATTERN.search(user_message)
+    if not match:
+        return None
+    words = re.findall(r"[a-z0-9']+", VIDEO_URL_PATTERN.sub(" ", user_message).lower())
+    tone = next((w for w in words if w in TONES), None)
+    options, residual = set(), []
+    for word in words:
+        option = next((name for name, triggers in OPTION_TRIGGERS.items() if word.startswith(triggers)), None)
+        if option:
+            options.add(option)
+        elif word not in FILLER_WORDS and word not in TONES:
+            residual.append(word)
+    return (match.group(1), tone, tuple(sorted(options)), " ".join(residual))
+
+class PipelineJob:
+    """
+    One plan_and_execute run shared by every chat session that asked for the same thing.
+
+    The worker thread appends progress strings and finally a ("result" | "error",
+    payload) tuple to ``events``; each subscriber keeps its own position in that
+    list, so one that joins late replays what it missed. The run is cancelled
+    only when its last subscriber leaves.
+    """
+
+    def __init__(self, key, user_message: str):
+        self.key = key
+        self.user_message = user_message
+        self.cancel_token = CancelToken()
+        # Tool calls get only what is left of the pipeline budget, so the server stops
+        # its work at the same moment the subscribers give up on it
+        self.deadline = time.monotonic() + PIPELINE_TIMEOUT_SECONDS
+        self.events = []
+        self.finished = False
+        self.subscribers = 0
+        self.start_time = datetime.now()
+
+    def start(self):
+        Thread(target=self._execute, daemon=True).start()
+        logger.info(f"Pipeline {self.key} started")
+
+    def _progress(self, status):
+        elapsed = (datetime.now() - self.start_time).total_seconds()
+        logger.info(f"[{elapsed:.1f}s] Progress: {status}")
+        self.events.append(status)
+
+    def _execute(self):
+        event = None
+        try:
+            logger.info("Starting plan execution in worker thread")
+            result = mcp_client.plan_and_execute(self.user_message, self._progress, self.cancel_token, self.deadline)
+            elapsed = (datetime.now() - self.start_time).total_seconds()
+            logger.info(f"Plan execution completed in {elapsed:.1f} seconds")
+            event = ("result", result)
+        except PipelineCancelled as e:
+            elapsed = (datetime.now() - self.start_time).total_seconds()
+            logger.info(f"Plan execution stopped after {elapsed:.1f} seconds: {e}")
+        except Exception as e:
+            elapsed = (datetime.now() - self.start_time).total_seconds()
+            logger.error(f"Plan execution failed after {elapsed:.1f} seconds: {str(e)}", exc_info=True)
+            event = ("error", str(e))
+        finally:
+            # Finished before the final event is visible, so a subscriber leaving
+            # after reading it never cancels a completed run
+            self.finished = True
+            _forget_job(self)
+            if event is not None:
+                self.events.append(event)
+
+_jobs = {}
+_jobs_lock = Lock()
+
+def _forget_job(job: PipelineJob):
+    with _jobs_lock:
+        if _jobs.get(job.key) is job:
+            del _jobs[job.key]
+
+def join_pipeline(user_message: str):
+    """Subscribe to the in-flight run for an identical request, or start a new one. Returns (job, joined)."""
+    key = pipeline_key(user_message)
+    with _jobs_lock:
+        job = _jobs.get(key) if key is not None else None
+        if job is not None and not job.cancel_token.cancelled:
+            job.subscribers += 1
+            return job, True
+        job = PipelineJob(key if key is not None else object(), user_message)
+        job.subscribers = 1
+        if key is not None:
+            _jobs[key] = job
+    job.start()
+    return job, False
+
+def leave_pipeline(job: PipelineJob, reason: str):
+    with _jobs_lock:
+        job.subscribers -= 1
+        last = job.subscribers <= 0
+    if last and not job.finished:
+        _forget_job(job)
+        job.cancel_token.cancel(reason)
+    elif not last:
+        logger.info(f"Subscriber left pipeline {job.key} ({reason}); {job.subscribers} still waiting")
+
+async def run_pipeline(websocket: WebSocket, user_message: str, cancel_token: CancelToken):
+    """Run (or join) a pipeline for the message and stream its progress to the WebSocket."""
+    job, joined = join_pipeline(user_message)
+    position = 0
+    if joined:
+        logger.info(f"Joined in-flight pipeline {job.key} ({job.subscribers} subscribers)")
+        await websocket.send_json({
+            "type": "progress",
+            "message": "🔗 An identical request is already running; sharing its progress and result..."
+        })
+    left = False
+    
+    try:
+        while True:
+            # Check for timeout; cancelling stops the server-side work too
+            if time.monotonic() > job.deadline:
+                logger.error(f"Execution timeout after {PIPELINE_TIMEOUT_SECONDS} seconds")
+                job.cancel_token.cancel(f"timed out after {PIPELINE_TIMEOUT_SECONDS} seconds")
+                await websocket.send_json({
+                    "type": "error",
+                    "message": f"Operation timed out after {PIPELINE_TIMEOUT_SECONDS} seconds. Please try with a shorter video or check server logs."
+                })
+                break
+            
+            # Report cancellation right away; the run itself stops once nobody is waiting for it
+            if cancel_token.cancelled:
+                leave_pipeline(job, cancel_token.reason)
+                left = True
+                await websocket.send_json({"type": "cancelled", "message": f"Request {cancel_token.reason}."})
+                break
+            if job.cancel_token.cancelled and position >= len(job.events):
+                await websocket.send_json({"type": "cancelled", "message": f"Request {job.cancel_token.reason}."})
+                break
+            
+            if position >= len(job.events):
+                await asyncio.sleep(0.1)
+                continue
+            item = job.events[position]
+            position += 1
+            
+            if isinstance(item, tuple) and item[0] == "result":
+                logger.info("Sending result to client")
+                await websocket.send_json({
+                    "type": "result",
+                    "result": item[1]
+                })
+                break
+            elif isinstance(item, tuple) and item[0] == "error":
+                logger.error(f"Sending error to client: {item[1]}")
+                await websocket.send_json({
+                    "type": "error",
+                    "message": item[1]
+                })
+                break
+            else:
+                # Progress update
+                await websocket.send_json({
+                    "type": "progress",
+                    "message": item
+                })
+    except (WebSocketDisconnect, RuntimeError) as e:
+        # Sending failed because the browser went away
+        logger.info(f"WebSocket gone while streaming progress: {e}")
+        cancel_token.cancel("client disconnected")
+    except Exception as e:
+        logger.error(f"Error in progress monitoring: {e}", exc_info=True)
+        cancel_token.cancel("monitoring failed")
+        await websocket.send_json({
+            "type": "error",
+            "message": f"Internal error: {str(e)}"
+        })
+    finally:
+        if not left:
+            leave_pipeline(job, cancel_token.reason or "subscriber finished")
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     client_id = f"{websocket.client.host}:{websocket.client.port}" if websocket.client else "unknown"
@@ -492,6 +723,9 @@ async def websocket_endpoint(websocket: WebSocket):
         logger.error(f"Failed to accept WebSocket connection: {e}")
         return
     
+    # The pipeline runs as a task so this loop keeps reading "cancel" messages
+    # and notices disconnects while it is in flight
+    task, cancel_token = None, None
     try:
         while True:
             data = await websocket.receive_text()
@@ -501,130 +735,180 @@ async def websocket_endpoint(websocket: WebSocket):
             if message_data.get("type") == "message":
                 user_message = message_data.get("content", "")
                 logger.info(f"Processing user message: {user_message[:100]}...")
-                start_time = datetime.now()
-                
-                # Queue for progress updates from the thread
-                progress_queue = Queue()
-                
-                # Progress callback function that queues messages
-                def progress_callback(status):
-                    elapsed = (datetime.now() - start_time).total_seconds()
-                    logger.info(f"[{elapsed:.1f}s] Progress: {status}")
-                    progress_queue.put(status)
-                
-                # Worker thread to execute the plan
-                def execute_plan():
-                    try:
-                        logger.info("Starting plan execution in worker thread")
-                        result = mcp_client.plan_and_execute(user_message, progress_callback)
-                        elapsed = (datetime.now() - start_time).total_seconds()
-                        logger.info(f"Plan execution completed in {elapsed:.1f} seconds")
-                        progress_queue.put(("result", result))
-                    except Exception as e:
-                        elapsed = (datetime.now() - start_time).total_seconds()
-                        logger.error(f"Plan execution failed after {elapsed:.1f} seconds: {str(e)}", exc_info=True)
-                        progress_queue.put(("error", str(e)))
-                
-                # Start execution in a thread
-                thread = Thread(target=execute_plan, daemon=True)
-                thread.start()
-                logger.info("Execution thread started")
-                
-                # Monitor progress queue and send updates with timeout
-                timeout_seconds = 600  # 10 minutes timeout
-                start_monitor = datetime.now()
-                
-                try:
-                    while thread.is_alive() or not progress_queue.empty():
-                        elapsed = (datetime.now() - start_monitor).total_seconds()
-                        
-                        # Check for timeout
-                        if elapsed > timeout_seconds:
-                            logger.error(f"Execution timeout after {timeout_seconds} seconds")
-                            await websocket.send_json({
-                                "type": "error",
-                                "message": f"Operation timed out after {timeout_seconds} seconds. Please try with a shorter video or check server logs."
-                            })
-                            break
-                        
-                        try:
-                            item = progress_queue.get(timeout=0.5)
-                            if isinstance(item, tuple) and item[0] == "result":
-                                logger.info("Sending result to client")
-                                await websocket.send_json({
-                                    "type": "result",
-                                    "result": item[1]
-                                })
-                                break
-                            elif isinstance(item, tuple) and item[0] == "error":
-                                logger.error(f"Sending error to client: {item[1]}")
-                                await websocket.send_json({
-                                    "type": "error",
-                                    "message": item[1]
-                                })
-                                break
-                            else:
-                                # Progress update
-                                await websocket.send_json({
-                                    "type": "progress",
-                                    "message": item
-                                })
-                        except:
-                            await asyncio.sleep(0.1)
-                    
-                    # Wait for thread to finish if still alive
-                    if thread.is_alive():
-                        logger.warning("Thread still alive after queue monitoring, waiting...")
-                        thread.join(timeout=5)
-                except Exception as e:
-                    logger.error(f"Error in progress monitoring: {e}", exc_info=True)
-                    await websocket.send_json({
-                        "type": "error",
-                        "message": f"Internal error: {str(e)}"
-                    })
+                if task is not None and not task.done():
+                    cancel_token.cancel("superseded by a new message")
+                cancel_token = CancelToken()
+                task = asyncio.create_task(run_pipeline(websocket, user_message, cancel_token))
+            elif message_data.get("type") == "cancel":
+                if task is not None and not task.done():
+                    logger.info(f"Cancel requested by {client_id}")
+                    cancel_token.cancel("cancelled by user")
     
     except WebSocketDisconnect:
         logger.info(f"WebSocket disconnected from {client_id}")
     except Exception as e:
         logger.error(f"WebSocket error: {e}", exc_info=True)
+    finally:
+        if task is not None and not task.done():
+            cancel_token.cancel("client disconnected")
 
-@app.get("/download/{file_path:path}")
-async def download_file(file_path: str):
-    from fastapi.responses import FileResponse
-    from fastapi import HTTPException
-    import os
-    
-    # Security: Only allow files in the server directory
+# Every file in the outputs directory is written once under a unique or
+# content-addressed name, so clients and proxies may cache it forever
+DOWNLOAD_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MEDIA_TYPES = {
+    '.pdf': 'application/pdf',
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.png': 'image/png',
+    '.svg': 'image/svg+xml',
+}
+# Precompressed siblings (<file>.gz / <file>.br) served when the client accepts them
+PRECOMPRESSED = [('br', '.br'), ('gzip', '.gz')]
+
+@lru_cache(maxsize=1024)
+def _content_etag(full_path, mtime_ns, size):
+    """Strong ETag from the file content; the cache key changes whenever the file does."""
+    digest = hashlib.sha256()
+    with open(full_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return f'"{digest.hexdigest()[:32]}"'
+
+def _variant_etag(etag, encoding):
+    """Each precompressed variant is a different byte sequence, so it gets its own strong ETag."""
+    return etag if encoding is None else f'{etag[:-1]}-{encoding}"'
+
+def _pick_precompressed(full_path, header_value):
+    """(encoding, path) of the best precompressed sibling the client accepts, or (None, full_path)."""
+    available = [encoding for encoding, suffix in PRECOMPRESSED if os.path.isfile(full_path + suffix)]
+    encoding = preferred(available, header_value)
+    if encoding is None:
+        return None, full_path
+    return encoding, full_path + dict(PRECOMPRESSED)[encoding]
+
+def _etag_matches(header_value, etag):
+    if header_value is None:
+        return False
+    candidates = [tag.strip() for tag in header_value.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+def _not_modified_since(header_value, mtime):
+    if header_value is None:
+        return False
+    try:
+        return int(mtime) <= parsedate_to_datetime(header_value).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+def _parse_range(header_value, size):
+    """
+    Parse a single "bytes=" range into (start, end) inclusive.
+
+    Returns None to serve the whole file (no/unsupported/multi-range header) and
+    raises ValueError when the range cannot be satisfied.
+    """
+    if not header_value or not header_value.startswith('bytes=') or ',' in header_value:
+        return None
+    first, _, last = header_value[len('bytes='):].strip().partition('-')
+    try:
+        if first == '':
+            length = int(last)
+            if length <= 0:
+                raise ValueError("Empty suffix range")
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        raise ValueError("Malformed range")
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+def _iter_file(full_path, start, end):
+    with open(full_path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+@app.api_route("/download/{file_path:path}", methods=["GET", "HEAD"])
+async def download_file(file_path: str, request: Request):
+    # Security: Only allow files in the outputs directory
     # Normalize the path to prevent directory traversal
     file_path = file_path.lstrip('/')
     if '..' in file_path or file_path.startswith('/'):
         raise HTTPException(status_code=400, detail="Invalid file path")
+    # Hidden files are in-progress temp files or internal state
+    if any(part.startswith('.') for part in file_path.split('/')):
+        raise HTTPException(status_code=404, detail="File not found")
     
-    full_path = os.path.join(os.path.dirname(__file__), "server", file_path)
-    
-    # Additional security: ensure the resolved path is within server directory
-    server_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "server"))
-    full_path = os.path.abspath(full_path)
+    # Exporter URLs look like "outputs/<file>"
+    relative_path = file_path[len("outputs/"):] if file_path.startswith("outputs/") else file_path
+    full_path = os.path.abspath(os.path.join(OUTPUTS_DIR, relative_path))
     
-    if not full_path.startswith(server_dir):
+    # Additional security: ensure the resolved path is within the outputs directory
+    if not full_path.startswith(OUTPUTS_DIR + os.sep):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    if os.path.exists(full_path) and os.path.isfile(full_path):
-        # Determine content type
-        if file_path.endswith('.pdf'):
-            media_type = 'application/pdf'
-        elif file_path.endswith('.docx'):
-            media_type = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-        else:
-            media_type = 'application/octet-stream'
-        
-        return FileResponse(
-            full_path,
-            media_type=media_type,
-            filename=os.path.basename(file_path)
-        )
-    else:
+    if not os.path.isfile(full_path):
         raise HTTPException(status_code=404, detail="File not found")
+    
+    stat = os.stat(full_path)
+    # Hashing a large file must not block the event loop (cached per mtime/size afterwards)
+    etag = await asyncio.to_thread(_content_etag, full_path, stat.st_mtime_ns, stat.st_size)
+    # Whole-file requests may get a precompressed sibling; ranges are always of the identity body
+    encoding, serve_path = (None, full_path) if request.headers.get('range') else \
+        _pick_precompressed(full_path, request.headers.get('accept-encoding'))
+    etag = _variant_etag(etag, encoding)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': formatdate(stat.st_mtime, usegmt=True),
+        'Cache-Control': DOWNLOAD_CACHE_CONTROL,
+        'Accept-Ranges': 'bytes',
+        'Vary': 'Accept-Encoding',
+    }
+    
+    # Conditional requests: If-None-Match takes precedence over If-Modified-Since
+    if_none_match = request.headers.get('if-none-match')
+    if _etag_matches(if_none_match, etag) or (
+            if_none_match is None and _not_modified_since(request.headers.get('if-modified-since'), stat.st_mtime)):
+        return Response(status_code=304, headers=headers)
+    
+    media_type = MEDIA_TYPES.get(os.path.splitext(full_path)[1], 'application/octet-stream')
+    headers['Content-Disposition'] = f'attachment; filename="{os.path.basename(full_path)}"'
+    
+    # Range requests (resumable downloads); If-Range falls back to the full body when stale
+    range_header = request.headers.get('range')
+    if_range = request.headers.get('if-range')
+    if range_header and if_range and if_range != etag and not _not_modified_since(if_range, stat.st_mtime):
+        range_header = None
+    try:
+        byte_range = _parse_range(range_header, stat.st_size)
+    except ValueError:
+        headers['Content-Range'] = f'bytes */{stat.st_size}'
+        return Response(status_code=416, headers=headers)
+    
+    if byte_range is not None:
+        start, end = byte_range
+        headers['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        headers['Content-Length'] = str(end - start + 1)
+        if request.method == 'HEAD':
+            return Response(status_code=206, headers=headers, media_type=media_type)
+        return StreamingResponse(_iter_file(full_path, start, end), status_code=206, headers=headers, media_type=media_type)
+    
+    # Whole file: the precompressed sibling picked above, if any
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    
+    if request.method == 'HEAD':
+        headers['Content-Length'] = str(os.path.getsize(serve_path))
+        return Response(status_code=200, headers=headers, media_type=media_type)
+    return FileResponse(serve_path, media_type=media_type, headers=headers)
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,7 +1,32 @@
 import json, requests
+import gzip
+import re
 import logging
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 from datetime import datetime
+from pathlib import Path
+
+# The record/replay cassette and the video ID parsing are shared with the server
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from server.cassette import get_cassette
+from server.video_ids import VIDEO_ID_PATTERN, video_id_of
+
+# Optional wire codecs; without them the client speaks plain JSON
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 # Configure logging
 logging.basicConfig(
@@ -19,18 +44,122 @@ openai_client = OpenAI(
     base_url="OPENAI_URL" #replace OPENAI_URL with actual url
 )
 
+class PipelineCancelled(Exception):
+    """Raised when a plan_and_execute run is cancelled through its CancelToken."""
+
+# Per-tool ceiling when the caller sets no deadline, and the extra time the HTTP
+# request waits beyond the server-side budget for the error response to arrive
+TOOL_TIMEOUT_SECONDS = 300
+DEADLINE_GRACE_SECONDS = 5
+
+# Wire format for /jsonrpc: "json" (default) or "msgpack", compressed with "gzip",
+# "zstd" or "none". Bodies below MIN_COMPRESS_BYTES are sent uncompressed.
+WIRE_FORMAT = os.getenv("MCP_WIRE_FORMAT", "json")
+WIRE_COMPRESSION = os.getenv("MCP_WIRE_COMPRESSION", "none")
+MIN_COMPRESS_BYTES = 1024
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# Ask the server for a profile of every tool call (the server must run with MCP_PROFILING=1)
+PROFILE_TOOLS = os.getenv("MCP_PROFILE_TOOLS", "0") == "1"
+# Scheduling class and fair-share identity sent with every tool call; a busy
+# server's "retry after" is honoured up to MAX_BUSY_RETRIES times
+PRIORITY = os.getenv("MCP_PRIORITY", "interactive")
+CLIENT_ID = os.getenv("MCP_CLIENT_ID", socket.gethostname())
+MAX_BUSY_RETRIES = 3
+# Hand back an earlier conversion of the same video and tone instead of re-running the pipeline
+REUSE_EXISTING = os.getenv("MCP_REUSE_EXISTING", "1") == "1"
+# Transcripts of videos linked in the goal are fetched while the planner runs
+MAX_SPECULATIVE_FETCHES = 2
+
+class CancelToken:
+    """
+    Cancellation signal shared between the caller (e.g. the chatbot) and a running pipeline.
+
+    cancel() is safe to call from any thread; callbacks registered by in-flight
+    tool calls forward the cancellation to the MCP server.
+    """
+
+    def __init__(self):
+        self.reason = None
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason="cancelled by user"):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        logger.info(f"Pipeline cancelled: {reason}")
+        for callback in callbacks:
+            callback()
+
+    def wait(self, timeout):
+        """Sleep up to ``timeout`` seconds, waking early on cancel. Returns True if cancelled."""
+        return self._event.wait(timeout)
+
+    def check(self):
+        if self._event.is_set():
+            raise PipelineCancelled(f"Pipeline {self.reason}")
+
+    def register(self, callback):
+        """Run callback on cancel (right away if already cancelled). Returns an unregister function."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._callbacks.remove(callback) if callback in self._callbacks else None
+        callback()
+        return lambda: None
+
 class MCPClient:
-    def __init__(self, server_url):
+    def __init__(self, server_url, wire_format=None, compression=None, priority=None, client_id=None):
         self.server_url = server_url
+        self.priority = priority or PRIORITY
+        self.client_id = client_id or CLIENT_ID
+        self.wire_format = wire_format or WIRE_FORMAT
+        self.compression = compression or WIRE_COMPRESSION
+        if self.wire_format == "msgpack" and msgpack is None:
+            logger.warning("msgpack is not installed, using JSON")
+            self.wire_format = "json"
+        if self.compression == "zstd" and zstandard is None:
+            logger.warning("zstandard is not installed, using gzip")
+            self.compression = "gzip"
+    
+    def _post(self, payload, timeout):
+        """POST a JSON-RPC payload in the configured wire format and return the decoded response."""
+        if self.wire_format == "msgpack":
+            content_type, body = "application/msgpack", msgpack.packb(payload, use_bin_type=True)
+        else:
+            content_type, body = "application/json", json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        headers = {"Content-Type": content_type, "Accept": content_type,
+                   "Accept-Encoding": "identity" if self.compression == "none" else self.compression}
+        if self.compression != "none" and len(body) >= MIN_COMPRESS_BYTES:
+            body = zstandard.ZstdCompressor(level=3).compress(body) if self.compression == "zstd" else gzip.compress(body, 5)
+            headers["Content-Encoding"] = self.compression
+        response = requests.post(f"{self.server_url}/jsonrpc", data=body, headers=headers, timeout=timeout)
+        response.raise_for_status()
+        # requests already undoes gzip (and zstd, if urllib3 has zstandard); decode whatever is left
+        data = response.content
+        coding = response.headers.get("Content-Encoding")
+        if coding == "zstd" and data[:4] == ZSTD_MAGIC:
+            data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        elif coding == "gzip" and data[:2] == b"\x1f\x8b":
+            data = gzip.decompress(data)
+        if response.headers.get("Content-Type", "").startswith(("application/msgpack", "application/x-msgpack")):
+            return msgpack.unpackb(data, raw=False)
+        return json.loads(data)
     
     def list_tools(self):
         logger.info(f"Fetching tools from MCP server: {self.server_url}")
         start_time = datetime.now()
         payload = {"jsonrpc": "2.0", "id": 1, "method": "list_tools"}
         try:
-            response = requests.post(f"{self.server_url}/jsonrpc", json=payload, timeout=10)
-            response.raise_for_status()
-            json_response = response.json()
+            json_response = self._post(payload, timeout=10)
             elapsed = (datetime.now() - start_time).total_seconds()
             
             if "error" in json_response:
@@ -47,25 +176,151 @@ class MCPClient:
             logger.error(f"Error listing tools: {e}", exc_info=True)
             raise
     
-    def call_tool(self, tool, inputs):
+    def validate_plan(self, steps):
+        """Check a plan against the tool manifests on the server; returns a list of errors (empty if valid)."""
+        payload = {"jsonrpc": "2.0", "id": 1, "method": "validate_plan", "params": {"plan": steps}}
+        json_response = self._post(payload, timeout=10)
+        if "error" in json_response:
+            # Servers without plan validation still check each call's inputs at dispatch
+            logger.warning(f"Plan validation unavailable: {json_response['error'].get('message')}")
+            return []
+        return json_response["result"]["errors"]
+    
+    def find_existing(self, video, tone=None, need_diagram=False):
+        """Newest exported conversion of a video (URL or ID) and tone in the server's library, or None."""
+        payload = {"jsonrpc": "2.0", "id": 1, "method": "find_existing",
+                   "params": {"video": video, "tone": tone, "need_diagram": need_diagram}}
+        try:
+            json_response = self._post(payload, timeout=10)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Library lookup failed: {e}")
+            return None
+        if "error" in json_response:
+            logger.warning(f"Library lookup unavailable: {json_response['error'].get('message')}")
+            return None
+        return json_response["result"]
+
+    def export_archive(self, blogs, destination, combined_pdf=False, include=None):
+        """
+        Download many blogs in one response: a ZIP (or with combined_pdf, one PDF) written to ``destination``.
+
+        ``blogs`` are video URLs/IDs, ``{"video": ..., "tone": ...}`` or ``{"blog_markdown": ...}``.
+        The body is written as the server streams it; returns the number of bytes.
+        """
+        logger.info(f"Bulk exporting {len(blogs)} blogs to {destination}")
+        start_time = datetime.now()
+        request = {"blogs": blogs, "format": "pdf" if combined_pdf else "zip"}
+        if include:
+            request["include"] = include
+        written = 0
+        headers = {"X-Client-Id": self.client_id}
+        for attempt in range(MAX_BUSY_RETRIES + 1):
+            with requests.post(f"{self.server_url}/export", json=request, headers=headers, stream=True,
+                               timeout=TOOL_TIMEOUT_SECONDS) as response:
+                # Exports run as batch work on the server; a full queue answers 503 with Retry-After
+                retry_after = response.headers.get("Retry-After")
+                if response.status_code == 503 and retry_after and attempt < MAX_BUSY_RETRIES:
+                    logger.warning(f"Server busy, retrying bulk export in {retry_after}s")
+                    time.sleep(int(retry_after))
+                    continue
+                if response.status_code == 400:
+                    raise ValueError(response.text)
+                response.raise_for_status()
+                with open(destination, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+                        written += len(chunk)
+                break
+        elapsed = (datetime.now() - start_time).total_seconds()
+        logger.info(f"Bulk export of {len(blogs)} blogs finished in {elapsed:.2f}s ({written} bytes)")
+        return written
+
+    def _reusable_conversion(self, steps):
+        """An earlier conversion that satisfies this plan as is, or None."""
+        transcript = next((s for s in steps if s["tool"] == "TranscriptAgent.get_transcript"), None)
+        blog = next((s for s in steps if s["tool"] == "BlogAgent.generate_blog"), None)
+        if not REUSE_EXISTING or transcript is None or blog is None:
+            return None
+        blog_inputs = blog.get("inputs", {})
+        # Edits, chapters, a forced mode or regeneration ask for something new
+        if any(blog_inputs.get(k) for k in ("edit_instructions", "chapters", "mode", "regenerate")):
+            return None
+        video = transcript.get("inputs", {}).get("video_url")
+        need_diagram = any(s["tool"] == "VisualAgent.generate_diagram" for s in steps)
+        return self.find_existing(video, blog_inputs.get("tone", "educational"), need_diagram) if video else None
+    
+    def cancel_request(self, request_id, reason="cancelled by client"):
+        """Ask the server to abort an in-flight call_tool request."""
+        payload = {"jsonrpc": "2.0", "id": 1, "method": "cancel", "params": {"request_id": request_id, "reason": reason}}
+        try:
+            self._post(payload, timeout=10)
+            logger.info(f"Sent cancel for request {request_id}")
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Failed to send cancel for request {request_id}: {e}")
+    
+    def call_tool(self, tool, inputs, cancel_token=None, deadline=None):
+        """
+        Call a tool on the server.
+
+        ``deadline`` is a time.monotonic() value; the remaining seconds are sent as
+        the request's ``timeout`` so the server stops the tool when they run out.
+        """
         logger.info(f"Calling tool: {tool} with inputs: {list(inputs.keys())}")
         start_time = datetime.now()
-        payload = {"jsonrpc": "2.0", "id": 1, "method": "call_tool", "params": {"tool": tool, "inputs": inputs}}
+        request_id = uuid.uuid4().hex
+        budget = TOOL_TIMEOUT_SECONDS if deadline is None else min(deadline - time.monotonic(), TOOL_TIMEOUT_SECONDS)
+        if budget <= 0:
+            raise Exception(f"Tool {tool} not started: pipeline deadline exceeded")
+        payload = {"jsonrpc": "2.0", "id": 1, "method": "call_tool",
+                   "params": {"tool": tool, "inputs": inputs, "request_id": request_id, "timeout": budget,
+                              "priority": self.priority, "client_id": self.client_id}}
+        if PROFILE_TOOLS:
+            payload["params"]["profile"] = True
+        unregister = lambda: None
+        if cancel_token is not None:
+            cancel_token.check()
+            # Forward a cancel to the server without blocking whoever called cancel()
+            unregister = cancel_token.register(lambda: threading.Thread(
+                target=self.cancel_request, args=(request_id, cancel_token.reason), daemon=True).start())
         try:
-            response = requests.post(f"{self.server_url}/jsonrpc", json=payload, timeout=300)  # 5 min timeout per tool
-            response.raise_for_status()
-            json_response = response.json()
+            for attempt in range(MAX_BUSY_RETRIES + 1):
+                json_response = self._post(payload, timeout=budget + DEADLINE_GRACE_SECONDS)
+                error = json_response.get("error") or {}
+                if not error.get("busy") or attempt == MAX_BUSY_RETRIES:
+                    break
+                retry_after = error.get("retry_after", 1)
+                if deadline is not None and deadline - time.monotonic() <= retry_after:
+                    break
+                logger.warning(f"Server busy, retrying {tool} in {retry_after}s")
+                if cancel_token is not None and cancel_token.wait(retry_after):
+                    cancel_token.check()
+                elif cancel_token is None:
+                    time.sleep(retry_after)
+                if deadline is not None:
+                    budget = min(deadline - time.monotonic(), TOOL_TIMEOUT_SECONDS)
+                    payload["params"]["timeout"] = budget
             elapsed = (datetime.now() - start_time).total_seconds()
             
             if "error" in json_response:
                 error_msg = json_response.get("error", {}).get("message", "Unknown error")
+                if json_response["error"].get("cancelled") and cancel_token is not None:
+                    cancel_token.check()
+                if json_response["error"].get("deadline_exceeded"):
+                    logger.error(f"Tool {tool} ran out of time after {elapsed:.2f}s: {error_msg}")
+                    raise Exception(f"Tool {tool} timed out: {error_msg}")
                 logger.error(f"Tool {tool} failed after {elapsed:.2f}s: {error_msg}")
                 raise Exception(f"Tool call error for {tool}: {error_msg}")
             
             logger.info(f"Tool {tool} completed in {elapsed:.2f}s")
+            if "profile" in json_response:
+                profile = json_response["profile"]
+                logger.info(f"Tool {tool} profile: {profile['seconds_by_category']}, report at {profile['report_url']}")
             return json_response["result"]
+        except PipelineCancelled:
+            logger.info(f"Tool {tool} cancelled after {(datetime.now() - start_time).total_seconds():.2f}s")
+            raise
         except requests.exceptions.Timeout:
-            logger.error(f"Tool {tool} timed out after 300 seconds")
+            logger.error(f"Tool {tool} timed out after {budget + DEADLINE_GRACE_SECONDS:.0f} seconds")
             raise Exception(f"Tool {tool} timed out")
         except requests.exceptions.RequestException as e:
             logger.error(f"Network error calling tool {tool}: {e}")
@@ -73,15 +328,62 @@ class MCPClient:
         except Exception as e:
             logger.error(f"Error calling tool {tool}: {e}", exc_info=True)
             raise
+        finally:
+            unregister()
+    
+    def _start_speculative_fetches(self, goal, cancel_token, deadline):
+        """Start get_transcript for the videos linked in the goal; returns {video_id: (future, token)}."""
+        video_ids = list(dict.fromkeys(VIDEO_ID_PATTERN.findall(goal)))[:MAX_SPECULATIVE_FETCHES]
+        if not video_ids:
+            return {}
+        pool = ThreadPoolExecutor(max_workers=len(video_ids), thread_name_prefix="speculative-fetch")
+        speculative = {}
+        for video_id in video_ids:
+            # Own token, so an unused fetch can be dropped without touching the pipeline
+            token = CancelToken()
+            if cancel_token is not None:
+                cancel_token.register(lambda token=token: token.cancel(cancel_token.reason))
+            future = pool.submit(self.call_tool, "TranscriptAgent.get_transcript", {"video_url": video_id}, token, deadline)
+            speculative[video_id] = (future, token)
+            logger.info(f"Speculatively fetching transcript for {video_id} while planning")
+        pool.shutdown(wait=False)
+        return speculative
     
-    def plan_and_execute(self, goal, progress_callback=None):
+    def _speculative_result(self, speculative, inputs, cancel_token):
+        """The speculatively fetched transcript for these get_transcript inputs, or None to call the tool normally."""
+        spec = speculative.pop(video_id_of(inputs.get("video_url")), None)
+        if spec is None:
+            return None
+        future, _ = spec
+        try:
+            return future.result()
+        except Exception as e:
+            if cancel_token is not None:
+                cancel_token.check()
+            logger.warning(f"Speculative transcript fetch failed, fetching again: {e}")
+            return None
+    
+    def plan_and_execute(self, goal, progress_callback=None, cancel_token=None, deadline=None):
         """
         Plan and execute a goal using available MCP tools.
         
         Args:
             goal: The user's goal/request
             progress_callback: Optional callback function(status_message) for progress updates
+            cancel_token: Optional CancelToken; cancelling it aborts the current tool call on the server
+                and raises PipelineCancelled
+            deadline: Optional time.monotonic() value the whole run must finish by; planning
+                and every tool call only get the time that is left
         """
+        speculative = self._start_speculative_fetches(goal, cancel_token, deadline)
+        try:
+            return self._plan_and_execute(goal, progress_callback, cancel_token, deadline, speculative)
+        finally:
+            # Whatever the plan did not use is cancelled (and its server-side call with it)
+            for _, token in speculative.values():
+                token.cancel("speculative fetch not used")
+    
+    def _plan_and_execute(self, goal, progress_callback, cancel_token, deadline, speculative):
         tools = self.list_tools()
         
         # Enhanced prompt engineering for better planning
@@ -114,14 +416,14 @@ PLANNING INSTRUCTIONS:
 2. Create a logical sequence of tool calls that will accomplish the goal.
 3. For YouTube-to-blog workflows, ALWAYS follow this sequence:
    - Step 1: Use TranscriptAgent.get_transcript with the video_url parameter
-   - Step 2: Use BlogAgent.generate_blog with clean_transcript from Step 1
+   - Step 2: Use BlogAgent.generate_blog with clean_transcript and video_id from Step 1 (pass chapters if the user provided chapter timestamps)
    - Step 3 (optional): Use VisualAgent.generate_diagram if diagrams are needed
-   - Step 4: Use ExporterAgent.export_blog with blog_markdown from Step 2
+   - Step 4: Use ExporterAgent.export_blog with blog_markdown from Step 2 (and diagram_url from Step 3 if a diagram was generated)
 
 4. Use $prev.output_key syntax to chain outputs between steps:
-   - TranscriptAgent outputs: clean_transcript
+   - TranscriptAgent outputs: clean_transcript, video_id, segments_url
    - BlogAgent outputs: blog_markdown
-   - VisualAgent outputs: diagram_url
+   - VisualAgent outputs: diagram_url, diagram_svg_url
    - ExporterAgent outputs: docx_url, pdf_url
 
 5. Extract video URLs/IDs from the goal text. Support formats:
@@ -133,6 +435,7 @@ PLANNING INSTRUCTIONS:
 6. If the user asks for a "blog", "article", or "document", include the export step.
 7. If the user mentions "diagrams", "flowcharts", or "architecture", include VisualAgent.
 8. Choose appropriate tone for BlogAgent (educational, casual, professional) based on context.
+9. If the user asks for specific changes to the blog content (shorter, add a summary, etc.), pass them as edit_instructions to BlogAgent.
 
 RESPONSE FORMAT (JSON only, no markdown):
 {{
@@ -156,21 +459,26 @@ CRITICAL: Return ONLY valid JSON. No markdown code blocks, no explanations outsi
         logger.info("Sending planning request to LLM")
         plan_start = datetime.now()
         try:
-            plan_response = openai_client.chat.completions.create(
-                model="gpt-4o", 
-                messages=[
+            request = {
+                "model": "gpt-4o",
+                "messages": [
                     {"role": "system", "content": "You are an expert workflow planner. Always respond with valid JSON only, no markdown or explanations."},
                     {"role": "user", "content": plan_prompt}
                 ],
-                temperature=0.3,  # Lower temperature for more consistent planning
-                timeout=60.0  # 60 second timeout for planning
+                "temperature": 0.3  # Lower temperature for more consistent planning
+            }
+            timeout = 60.0 if deadline is None else max(min(60.0, deadline - time.monotonic()), 1.0)
+            plan_content = get_cassette().call(
+                "openai.chat", request,
+                lambda: openai_client.chat.completions.create(**request, timeout=timeout).choices[0].message.content
             )
             plan_elapsed = (datetime.now() - plan_start).total_seconds()
             logger.info(f"LLM planning completed in {plan_elapsed:.2f}s")
-            plan_content = plan_response.choices[0].message.content
         except Exception as e:
             logger.error(f"LLM planning failed: {e}", exc_info=True)
             raise Exception(f"Failed to create execution plan: {str(e)}")
+        if cancel_token is not None:
+            cancel_token.check()
         
         # Try to extract JSON from the response (in case it's wrapped in markdown code blocks)
         if "```json" in plan_content:
@@ -193,6 +501,31 @@ CRITICAL: Return ONLY valid JSON. No markdown code blocks, no explanations outsi
                 raise Exception(f"Failed to parse plan JSON: {str(e)}\nResponse: {plan_content[:200]}")
         
         steps = plan["plan"]
+        # Fail in milliseconds on a bad plan instead of after the paid steps before the bad one
+        errors = self.validate_plan(steps)
+        if errors:
+            logger.error(f"Plan failed validation: {errors}")
+            raise Exception("Invalid execution plan: " + "; ".join(errors))
+        
+        lookup_start = datetime.now()
+        existing = self._reusable_conversion(steps)
+        if existing is not None:
+            logger.info(f"Reusing conversion of {existing['video_id']} ({existing['tone']}) exported at {existing['exported_at']}")
+            if progress_callback:
+                progress_callback("📚 This video was already converted with these options; reusing the existing blog and documents")
+            context = {k: existing[k] for k in ("video_id", "blog_markdown", "docx_url", "pdf_url", "diagram_url") if existing.get(k)}
+            return {
+                "context": context,
+                "execution_log": [{
+                    "step": 1,
+                    "tool": "Library.find_existing",
+                    "description": "Reused an earlier conversion of this video",
+                    "status": "success",
+                    "duration_seconds": (datetime.now() - lookup_start).total_seconds(),
+                    "output_keys": list(context)
+                }],
+                "final_result": context
+            }
         context = {}
         execution_log = []
         
@@ -219,7 +552,13 @@ CRITICAL: Return ONLY valid JSON. No markdown code blocks, no explanations outsi
                 if progress_callback:
                     progress_callback(f"[{i}/{len(steps)}] Executing: {step_desc}")
                 
-                result = self.call_tool(tool, inputs)
+                result = None
+                if tool == "TranscriptAgent.get_transcript":
+                    result = self._speculative_result(speculative, inputs, cancel_token)
+                    if result is not None:
+                        logger.info(f"Step {i} served by the transcript fetched during planning")
+                if result is None:
+                    result = self.call_tool(tool, inputs, cancel_token, deadline)
                 context.update(result)
                 step_elapsed = (datetime.now() - step_start).total_seconds()
                 
@@ -236,6 +575,10 @@ CRITICAL: Return ONLY valid JSON. No markdown code blocks, no explanations outsi
                 
                 if progress_callback:
                     progress_callback(f"✓ Step {i} completed in {step_elapsed:.1f}s: {tool}")
+            except PipelineCancelled:
+                step_elapsed = (datetime.now() - step_start).total_seconds()
+                logger.info(f"Step {i} cancelled after {step_elapsed:.2f}s")
+                raise
             except Exception as e:
                 step_elapsed = (datetime.now() - step_start).total_seconds()
                 error_msg = str(e)
@@ -1,48 +1,278 @@
 from openai import OpenAI
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from segments import load_segments
+from sections import detect_sections, sentence_segments
+from cache import get_cache
+from cassette import get_cassette
+from library import Library, index_safely
+from request_context import RequestCancelled, RequestContext, current_context, check_cancelled, remaining_budget, require_budget, set_context
+import contextvars
+import hashlib
 import logging
+import os
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
-# Custom LiteLLM proxy endpoint
-client = OpenAI(
-    base_url="OPENAI_URL" #replace OPENAI_URL with actual url
-)
+# Transcripts longer than this are generated section by section in auto mode
+SECTION_THRESHOLD = int(os.getenv("MCP_SECTION_THRESHOLD", "20000"))
+SECTION_CHARS = int(os.getenv("MCP_SECTION_CHARS", "12000"))
+SECTION_CONCURRENCY = int(os.getenv("MCP_SECTION_CONCURRENCY", "6"))
+CONCLUSION_MARKER = "===CONCLUSION==="
+# Deadline handling: below MIN_LLM_SECONDS an LLM call is refused outright, below
+# SECTION_BUDGET_SECONDS long-ish transcripts switch to parallel sections, and the
+# intro/conclusion pass is skipped when less than MIN_FRAME_SECONDS remain
+MIN_LLM_SECONDS = float(os.getenv("MCP_MIN_LLM_SECONDS", "10"))
+SECTION_BUDGET_SECONDS = float(os.getenv("MCP_SECTION_BUDGET_SECONDS", "120"))
+MIN_FRAME_SECONDS = float(os.getenv("MCP_MIN_FRAME_SECONDS", "20"))
 
-def generate_blog(clean_transcript: str, tone: str = "educational"):
-    logger.info(f"Starting blog generation. Transcript length: {len(clean_transcript)} chars, Tone: {tone}")
-    start_time = datetime.now()
-    
+_client = None
+
+def get_client():
+    """Create the OpenAI client on first use rather than at import time."""
+    global _client
+    if _client is None:
+        # Custom LiteLLM proxy endpoint
+        _client = OpenAI(
+            base_url="OPENAI_URL" #replace OPENAI_URL with actual url
+        )
+    return _client
+
+def _complete(prompt: str, timeout: float = 300.0) -> str:
+    require_budget(MIN_LLM_SECONDS, "an LLM call")
+    request = {"model": "gpt-4o", "messages": [{"role": "user", "content": prompt}]}
+    return get_cassette().call("openai.chat", request, lambda: _stream_completion(request, min(timeout, remaining_budget())))
+
+def _stream_completion(request: dict, timeout: float) -> str:
+    # Streamed so a cancelled request can close the HTTP response mid-generation
+    # instead of paying for the rest of it
+    ctx = current_context()
+    # Note: OpenAI client timeout is set via timeout parameter (in seconds)
+    # For very long transcripts, this might take several minutes
     try:
-        # Check if transcript is too long (might need chunking)
-        transcript_length = len(clean_transcript)
-        if transcript_length > 100000:  # ~100k chars
-            logger.warning(f"Large transcript detected ({transcript_length} chars). This may take a while.")
-        
-        prompt = f"Create a detailed blog in {tone} tone from this transcript:\n{clean_transcript}"
-        
-        logger.info("Sending blog generation request to LLM...")
-        # Note: OpenAI client timeout is set via timeout parameter (in seconds)
-        # For very long transcripts, this might take several minutes
+        stream = get_client().chat.completions.create(**request, timeout=timeout, stream=True)
+        unregister = ctx.register_abort(stream.close) if ctx else (lambda: None)
         try:
-            response = client.chat.completions.create(
-                model="gpt-4o", 
-                messages=[{"role": "user", "content": prompt}],
-                timeout=300.0  # 5 minute timeout
-            )
-        except Exception as e:
-            if "timeout" in str(e).lower() or "timed out" in str(e).lower():
-                logger.error("LLM request timed out. Transcript may be too long.")
-                raise Exception("Blog generation timed out. The transcript may be too long. Try a shorter video.")
-            raise
-        
-        blog_content = response.choices[0].message.content
+            parts = []
+            for chunk in stream:
+                check_cancelled()
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+        finally:
+            unregister()
+            stream.close()
+    except Exception as e:
+        check_cancelled()  # errors caused by closing the stream surface as a cancellation
+        if "timeout" in str(e).lower() or "timed out" in str(e).lower():
+            logger.error("LLM request timed out. Transcript may be too long.")
+            raise Exception("Blog generation timed out. The transcript may be too long. Try a shorter video.")
+        raise
+    return "".join(parts)
+
+def _format_timestamp(seconds: float) -> str:
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes}:{secs:02d}"
+
+def _generate_section(section: dict, index: int, total: int, tone: str) -> str:
+    hints = []
+    if section["title"]:
+        hints.append(f"The video chapter is titled \"{section['title']}\".")
+    if section["start"] is not None:
+        hints.append(f"It starts at {_format_timestamp(section['start'])} in the video.")
+    prompt = (
+        f"You are writing section {index} of {total} of a blog post in {tone} tone, based on a YouTube video transcript. "
+        + " ".join(hints)
+        + "\nWrite ONLY this section: start with a '## ' heading, use markdown, and do not add an introduction "
+          "or conclusion for the whole post.\n\nTranscript excerpt:\n"
+        + section["text"]
+    )
+    started = datetime.now()
+    draft = _complete(prompt)
+    logger.info(f"Section {index}/{total} generated in {(datetime.now() - started).total_seconds():.2f}s ({len(draft)} chars)")
+    return draft
+
+def _generate_frame(drafts: list, tone: str):
+    """One short pass for the title, introduction and conclusion around the section drafts."""
+    outline = "\n".join(
+        f"- {draft.strip().splitlines()[0].lstrip('# ').strip()}: {' '.join(draft.split())[:300]}"
+        for draft in drafts if draft.strip()
+    )
+    prompt = (
+        f"These are the sections of a blog post written in {tone} tone from a YouTube video:\n{outline}\n\n"
+        "Write a '# ' title line, then a short introduction (1-2 paragraphs), then a line containing only "
+        f"{CONCLUSION_MARKER}, then a short conclusion (1 paragraph). Use markdown and nothing else."
+    )
+    frame = _complete(prompt)
+    intro, _, conclusion = frame.partition(CONCLUSION_MARKER)
+    return intro.strip(), conclusion.strip()
+
+def _generate_sectioned(sections: list, tone: str):
+    # Sections are independent, so latency is the slowest section plus the short framing pass
+    drafts = _map_concurrently(lambda i, section: _generate_section(section, i, len(sections), tone), sections)
+    if remaining_budget() < MIN_FRAME_SECONDS:
+        logger.warning("Skipping intro/conclusion pass: request deadline is too close")
+        return drafts, "", ""
+    intro, conclusion = _generate_frame(drafts, tone)
+    return drafts, intro, conclusion
+
+def _map_concurrently(func, items: list) -> list:
+    """
+    func(i, item) for every item on up to SECTION_CONCURRENCY threads, results in order.
+
+    The calls run under a child of the request context. The first failure
+    cancels it, so the other calls close their LLM streams and stop at their
+    next checkpoint, as they do when the request itself is cancelled.
+    """
+    parent = current_context()
+    group = RequestContext(f"{parent.request_id if parent else 'local'}/sections", deadline=parent.deadline if parent else None)
+    unregister = (parent.register_abort(lambda: group.expire() if parent.deadline_exceeded else group.cancel(parent.reason))
+                  if parent else (lambda: None))
+
+    def run(i, item):
+        set_context(group)
+        return func(i, item)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(SECTION_CONCURRENCY, len(items)))) as pool:
+            # copy_context() gives each call its own context (and whatever else the caller set)
+            futures = [pool.submit(contextvars.copy_context().run, run, i, item) for i, item in enumerate(items, 1)]
+            done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+            failed = next((future for future in futures if future in done and future.exception()), None)
+            if failed is None:
+                return [future.result() for future in futures]
+            group.cancel(f"a sibling call failed: {failed.exception()}")
+            for future in pending:
+                future.cancel()
+            raise failed.exception()
+    finally:
+        unregister()
+
+def _stitch(record: dict) -> str:
+    if not record["intro"] and not record["conclusion"] and len(record["sections"]) == 1:
+        return record["sections"][0]
+    parts = [record["intro"]] + [draft.strip() for draft in record["sections"]]
+    if record["conclusion"]:
+        parts.append(f"## Conclusion\n\n{record['conclusion']}")
+    return "\n\n".join(part for part in parts if part)
+
+def _outline(drafts: list) -> list:
+    return [line.lstrip("#").strip() for draft in drafts for line in draft.splitlines() if line.startswith("#")]
+
+def _key_points(drafts: list, limit: int = 20) -> list:
+    points = [line.strip()[2:].strip() for draft in drafts for line in draft.splitlines()
+              if line.strip().startswith(("- ", "* "))]
+    return points[:limit]
+
+def _restyle(text: str, tone: str, edit_instructions: str = None, what: str = "blog post") -> str:
+    if not text.strip():
+        return text
+    prompt = (
+        f"Rewrite the following {what} in {tone} tone. Keep the markdown structure, headings and all facts; "
+        "change only the wording and style."
+    )
+    if edit_instructions:
+        prompt += f" Also apply these edits: {edit_instructions}"
+    return _complete(f"{prompt}\nReturn only the rewritten markdown.\n\n{text}")
+
+def _restyle_record(record: dict, tone: str, edit_instructions: str = None) -> str:
+    """
+    Cheap re-run: rewrite the cached drafts instead of regenerating from the transcript.
+
+    Always restyles the base drafts (not an earlier variant), so repeated tone
+    changes do not drift. Pure tone changes rewrite the pieces concurrently;
+    edits need the whole post in view and use a single pass.
+    """
+    if edit_instructions or len(record["sections"]) == 1:
+        return _restyle(_stitch(record), tone, edit_instructions)
+    pieces = [("introduction of a blog post", record["intro"])]
+    pieces += [("section of a blog post", draft) for draft in record["sections"]]
+    pieces.append(("conclusion of a blog post", record["conclusion"]))
+    rewritten = _map_concurrently(lambda i, piece: _restyle(piece[1], tone, edit_instructions, piece[0]), pieces)
+    return _stitch({"intro": rewritten[0], "sections": rewritten[1:-1], "conclusion": rewritten[-1]})
+
+def transcript_hash(clean_transcript: str) -> str:
+    return hashlib.sha256(clean_transcript.encode("utf-8")).hexdigest()
+
+def generate_blog(clean_transcript: str, tone: str = "educational", video_id: str = None, chapters=None, mode: str = "auto",
+                  edit_instructions: str = None, regenerate: bool = False):
+    logger.info(f"Starting blog generation. Transcript length: {len(clean_transcript)} chars, Tone: {tone}, Mode: {mode}")
+    start_time = datetime.now()
+
+    try:
+        # Intermediates (outline, key points, section drafts) are reused across tone changes and edits
+        key = transcript_hash(clean_transcript)
+        cache = get_cache()
+        record = None if regenerate else cache.get("blog", key)
+        if record is not None and chapters and record.get("chapters") != chapters:
+            record = None  # different section structure requested
+
+        if record is not None:
+            variant = record["variants"].get(tone)
+            if variant is not None and not edit_instructions:
+                logger.info(f"Reusing cached blog for transcript {key[:12]} in {tone} tone")
+                blog_content = variant
+            else:
+                logger.info(f"Restyling cached drafts for transcript {key[:12]}: {len(record['sections'])} sections -> {tone} tone")
+                blog_content = _restyle_record(record, tone, edit_instructions)
+                if not edit_instructions:
+                    record["variants"][tone] = blog_content
+                    cache.set("blog", key, record)
+        else:
+            # Check if transcript is too long (might need chunking)
+            transcript_length = len(clean_transcript)
+            if transcript_length > 100000:  # ~100k chars
+                logger.warning(f"Large transcript detected ({transcript_length} chars). This may take a while.")
+
+            # A tight deadline also favours sections: latency then follows the longest section
+            tight = remaining_budget() < SECTION_BUDGET_SECONDS and transcript_length > SECTION_CHARS
+            sectioned = mode == "sections" or (mode == "auto" and (transcript_length > SECTION_THRESHOLD or chapters or tight))
+            sections = []
+            if sectioned:
+                # Timed segments give chapter alignment; otherwise fall back to sentence units
+                segments = load_segments(video_id) if video_id else None
+                if segments is None or segments.text != clean_transcript:
+                    segments = sentence_segments(clean_transcript)
+                sections = detect_sections(segments, SECTION_CHARS, chapters=chapters)
+
+            if len(sections) > 1:
+                logger.info(f"Generating {len(sections)} sections concurrently (max {SECTION_CONCURRENCY} in flight)")
+                drafts, intro, conclusion = _generate_sectioned(sections, tone)
+            else:
+                prompt = f"Create a detailed blog in {tone} tone from this transcript:\n{clean_transcript}"
+                logger.info("Sending blog generation request to LLM...")
+                drafts, intro, conclusion = [_complete(prompt)], "", ""
+
+            record = {
+                "tone": tone,
+                "chapters": chapters,
+                "outline": _outline(drafts),
+                "key_points": _key_points(drafts),
+                "sections": drafts,
+                "intro": intro,
+                "conclusion": conclusion,
+                "variants": {}
+            }
+            blog_content = _stitch(record)
+            if edit_instructions:
+                blog_content = _restyle(blog_content, tone, edit_instructions)
+            else:
+                record["variants"][tone] = blog_content
+            cache.set("blog", key, record)
+
+        index_safely(Library.record_transcript, key, video_id, clean_transcript)
+        index_safely(Library.record_blog, blog_content, video_id=video_id, tone=tone, transcript_hash=key)
+
         blog_length = len(blog_content)
         elapsed = (datetime.now() - start_time).total_seconds()
-        
+
         logger.info(f"Blog generation completed in {elapsed:.2f}s. Blog length: {blog_length} characters")
-        
+
         return {"blog_markdown": blog_content}
+    except RequestCancelled:
+        elapsed = (datetime.now() - start_time).total_seconds()
+        logger.info(f"Blog generation cancelled after {elapsed:.2f}s")
+        raise
     except Exception as e:
         elapsed = (datetime.now() - start_time).total_seconds()
         logger.error(f"Blog generation failed after {elapsed:.2f}s: {str(e)}", exc_info=True)
@@ -1,35 +1,18 @@
 from docx import Document
+from docx.shared import Inches
 from reportlab.pdfgen import canvas
+from reportlab.graphics import renderPDF
+from storage import atomic_output, output_url, unique_stem
+from agents.visual_agent import build_drawing, diagram_file, load_spec
+from request_context import check_cancelled
+from library import Library, index_safely
+import logging
 import os
-from datetime import datetime
 
-def export_blog(blog_markdown: str, include_images: bool = True):
-    # Get the server directory
-    server_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    server_dir = os.path.join(server_dir, "server")
-    
-    # Create outputs directory if it doesn't exist
-    outputs_dir = os.path.join(server_dir, "outputs")
-    os.makedirs(outputs_dir, exist_ok=True)
-    
-    # Generate unique filenames with timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    docx_filename = f"blog_output_{timestamp}.docx"
-    pdf_filename = f"blog_output_{timestamp}.pdf"
-    
-    docx_path = os.path.join(outputs_dir, docx_filename)
-    pdf_path = os.path.join(outputs_dir, pdf_filename)
-    
-    # Create DOCX
-    doc = Document()
-    # Split markdown into paragraphs for better formatting
-    for line in blog_markdown.split('\n'):
-        if line.strip():
-            doc.add_paragraph(line.strip())
-    doc.save(docx_path)
-    
-    # Create PDF
-    c = canvas.Canvas(pdf_path)
+logger = logging.getLogger(__name__)
+
+def draw_pdf_pages(c, blog_markdown: str, spec: dict = None):
+    """Draw one blog (and its diagram) onto a canvas, starting at the top of the current page."""
     y_position = 800
     for line in blog_markdown.split('\n'):
         if line.strip():
@@ -38,9 +21,54 @@ def export_blog(blog_markdown: str, include_images: bool = True):
             if y_position < 50:
                 c.showPage()
                 y_position = 800
-    c.save()
-    
-    return {
-        "docx_url": f"outputs/{docx_filename}",
-        "pdf_url": f"outputs/{pdf_filename}"
-    }
\ No newline at end of file
+    if spec is not None:
+        drawing = build_drawing(spec)
+        scale = 500 / drawing.width
+        drawing.scale(scale, scale)
+        height = drawing.height * scale
+        if y_position - height < 50:
+            c.showPage()
+            y_position = 800
+        renderPDF.draw(drawing, c, 50, y_position - height)
+
+def export_blog(blog_markdown: str, include_images: bool = True, diagram_url: str = None):
+    # Generate unique filenames; the suffix keeps concurrent workers from clobbering each other
+    stem = unique_stem("blog_output")
+    docx_filename = f"{stem}.docx"
+    pdf_filename = f"{stem}.pdf"
+
+    # Diagrams rendered by VisualAgent keep their spec next to the image, so the
+    # PDF can embed it as vector graphics and the DOCX can use the PNG
+    spec = load_spec(diagram_url) if include_images and diagram_url else None
+    if include_images and diagram_url and spec is None:
+        logger.warning(f"Diagram {diagram_url} not found in outputs, exporting without it")
+
+    # Create DOCX
+    doc = Document()
+    # Split markdown into paragraphs for better formatting
+    for line in blog_markdown.split('\n'):
+        if line.strip():
+            doc.add_paragraph(line.strip())
+    if spec is not None:
+        png_path = diagram_file(diagram_url, "png")
+        if png_path is not None and os.path.exists(png_path):
+            doc.add_picture(png_path, width=Inches(6))
+        else:
+            logger.warning(f"No PNG rendering for {diagram_url}, DOCX exported without the diagram")
+    with atomic_output(docx_filename) as docx_path:
+        doc.save(docx_path)
+    check_cancelled()
+
+    # Create PDF
+    with atomic_output(pdf_filename) as pdf_path:
+        c = canvas.Canvas(pdf_path)
+        draw_pdf_pages(c, blog_markdown, spec)
+        c.save()
+
+    result = {
+        "docx_url": output_url(docx_filename),
+        "pdf_url": output_url(pdf_filename)
+    }
+    # Links the documents to the blog BlogAgent indexed, so the next request for this video can reuse them
+    index_safely(Library.record_blog, blog_markdown, diagram_url=diagram_url if spec is not None else None, **result)
+    return result
@@ -1,39 +1,58 @@
 from youtube_transcript_api import YouTubeTranscriptApi
 import logging
 from datetime import datetime
+from request_context import check_cancelled, require_budget
+from segments import TranscriptSegments, load_segments, save_segments, segments_url
+from cassette import get_cassette
+from video_ids import video_id_of
 
 logger = logging.getLogger(__name__)
 
+def extract_video_id(video_url: str) -> str:
+    video_id = video_id_of(video_url)
+    if video_id is None:
+        raise ValueError(f"Not a YouTube video URL or ID: {video_url!r}")
+    return video_id
+
 def get_transcript(video_url: str):
     logger.info(f"Starting transcript extraction for: {video_url}")
     start_time = datetime.now()
     
     # Extract video ID from URL
-    if "v=" in video_url:
-        video_id = video_url.split("v=")[-1].split("&")[0]
-    elif "youtu.be/" in video_url:
-        video_id = video_url.split("youtu.be/")[-1].split("?")[0]
-    else:
-        video_id = video_url  # Assume it's just the video ID
+    video_id = extract_video_id(video_url)
     
     logger.info(f"Extracted video ID: {video_id}")
     
+    # Transcripts never change, so any worker that already fetched this video serves
+    # it from the segment store in the shared outputs directory
+    segments = load_segments(video_id)
+    if segments is not None:
+        elapsed = (datetime.now() - start_time).total_seconds()
+        logger.info(f"Transcript store hit for {video_id} in {elapsed:.2f}s. {len(segments)} segments, {len(segments.text)} characters")
+        return {"clean_transcript": segments.text, "video_id": video_id, "segments_url": segments_url(video_id)}
+    
     try:
+        require_budget(2, "a transcript fetch")
         # Create API instance and fetch transcript
         logger.info("Fetching transcript from YouTube...")
-        api = YouTubeTranscriptApi()
-        transcript_data = api.fetch(video_id).to_raw_data()
+        transcript_data = get_cassette().call(
+            "youtube.fetch", {"video_id": video_id},
+            lambda: YouTubeTranscriptApi().fetch(video_id).to_raw_data()
+        )
         
         logger.info(f"Retrieved {len(transcript_data)} transcript segments")
+        check_cancelled()
         
-        # Extract text from transcript snippets
-        text = " ".join([t["text"] for t in transcript_data])
+        # Keep segment timings alongside the joined text
+        segments = TranscriptSegments.from_raw(transcript_data)
+        text = segments.text
         text_length = len(text)
+        stored_url = save_segments(video_id, segments)
         elapsed = (datetime.now() - start_time).total_seconds()
         
         logger.info(f"Transcript extraction completed in {elapsed:.2f}s. Text length: {text_length} characters")
         
-        return {"clean_transcript": text}
+        return {"clean_transcript": text, "video_id": video_id, "segments_url": stored_url}
     except Exception as e:
         elapsed = (datetime.now() - start_time).total_seconds()
         logger.error(f"Transcript extraction failed after {elapsed:.2f}s: {str(e)}", exc_info=True)
@@ -1,2 +1,374 @@
+from reportlab.graphics.shapes import Drawing, Rect, String, Line, Circle, Polygon
+from reportlab.graphics import renderSVG
+from reportlab.lib import colors
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from storage import OUTPUTS_DIR, atomic_output, output_path, output_url
+from request_context import DeadlineExceeded, check_cancelled, remaining_budget
+import multiprocessing
+import threading
+import hashlib
+import gzip
+import logging
+import json
+import math
+import os
+import re
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DIAGRAM_TYPES = ["architecture", "flow", "sequence", "er-diagram", "mindmap", "network"]
+MAX_NODES = 8
+RENDER_TIMEOUT = 60
+# The only diagram URLs generate_diagram hands out (see diagram_stem); anything
+# else passed in as diagram_url is ignored rather than resolved as a path
+DIAGRAM_URL_PATTERN = re.compile(r"outputs/(diagrams/[a-z-]+_[0-9a-f]{16})\.(?:png|svg)")
+
+WIDTH, HEIGHT = 640, 420
+BOX_W, BOX_H = 150, 44
+FILL = colors.HexColor("#eef0fd")
+STROKE = colors.HexColor("#667eea")
+ACCENT = colors.HexColor("#764ba2")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def extract_structure(context_text: str, diagram_type: str) -> dict:
+    """
+    Turn free text into a small diagram spec: a title plus up to MAX_NODES labels.
+
+    Markdown headings and bullet points are preferred; plain prose falls back to
+    the leading words of each sentence.
+    """
+    lines = [line.strip() for line in context_text.splitlines() if line.strip()]
+    headings = [re.sub(r"^#+\s*", "", line) for line in lines if line.startswith("#")]
+    bullets = [re.sub(r"^([-*+]|\d+[.)])\s+", "", line) for line in lines if re.match(r"^([-*+]|\d+[.)])\s+", line)]
+
+    title = headings[0] if headings else ""
+    items = headings[1:] + bullets
+    if len(items) < 3:
+        sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", " ".join(lines)) if len(s.strip()) > 3]
+        if not title and sentences:
+            title = " ".join(sentences[0].split()[:6])
+            sentences = sentences[1:]
+        items += [" ".join(s.split()[:5]).rstrip(".,;:!?") for s in sentences]
+
+    seen = set()
+    nodes = []
+    for item in items:
+        label = re.sub(r"[*_`]", "", item).strip()[:40]
+        if label and label.lower() not in seen:
+            seen.add(label.lower())
+            nodes.append(label)
+        if len(nodes) == MAX_NODES:
+            break
+
+    return {"type": diagram_type, "title": re.sub(r"[*_`]", "", title).strip()[:60] or diagram_type.title(), "nodes": nodes}
+
+
+def _wrap(label, width=20):
+    words, lines, current = label.split(), [], ""
+    for word in words:
+        if current and len(current) + len(word) + 1 > width:
+            lines.append(current)
+            current = word
+        else:
+            current = f"{current} {word}".strip()
+    lines.append(current)
+    return lines[:2]
+
+
+def _box(d, cx, cy, label, fill=FILL, w=BOX_W, h=BOX_H):
+    d.add(Rect(cx - w / 2, cy - h / 2, w, h, rx=6, ry=6, fillColor=fill, strokeColor=STROKE, strokeWidth=1.2))
+    lines = _wrap(label)
+    top = cy + 5 * (len(lines) - 1) - 3
+    for i, line in enumerate(lines):
+        d.add(String(cx, top - 11 * i, line, fontName="Helvetica", fontSize=9, textAnchor="middle"))
+
+
+def _arrow(d, x1, y1, x2, y2, color=STROKE):
+    d.add(Line(x1, y1, x2, y2, strokeColor=color, strokeWidth=1.2))
+    angle = math.atan2(y2 - y1, x2 - x1)
+    left = (x2 - 8 * math.cos(angle - 0.4), y2 - 8 * math.sin(angle - 0.4))
+    right = (x2 - 8 * math.cos(angle + 0.4), y2 - 8 * math.sin(angle + 0.4))
+    d.add(Polygon([x2, y2, left[0], left[1], right[0], right[1]], fillColor=color, strokeColor=color))
+
+
+def _layout_flow(d, nodes):
+    cols = min(len(nodes), 4)
+    rows = math.ceil(len(nodes) / cols)
+    points = []
+    for i in range(len(nodes)):
+        row, col = divmod(i, cols)
+        if row % 2:  # snake so consecutive steps stay adjacent
+            col = cols - 1 - col
+        points.append((WIDTH * (col + 0.5) / cols, HEIGHT - 70 - row * (HEIGHT - 100) / max(rows, 1)))
+    for (x1, y1), (x2, y2) in zip(points, points[1:]):
+        if y1 == y2:
+            sign = 1 if x2 > x1 else -1
+            _arrow(d, x1 + sign * BOX_W / 2, y1, x2 - sign * BOX_W / 2, y2)
+        else:
+            _arrow(d, x1, y1 - BOX_H / 2, x2, y2 + BOX_H / 2)
+    for (x, y), label in zip(points, nodes):
+        _box(d, x, y, label)
+
+
+def _layout_architecture(d, nodes):
+    layers = [nodes[i:i + 3] for i in range(0, len(nodes), 3)]
+    layer_h = (HEIGHT - 60) / max(len(layers), 1)
+    centers = []
+    for li, layer in enumerate(layers):
+        y = HEIGHT - 40 - layer_h * (li + 0.5)
+        d.add(Rect(15, y - layer_h / 2 + 6, WIDTH - 30, layer_h - 12, fillColor=None, strokeColor=ACCENT, strokeDashArray=[3, 3]))
+        centers.append([(WIDTH * (i + 0.5) / len(layer), y) for i in range(len(layer))])
+        for (x, _), label in zip(centers[-1], layer):
+            _box(d, x, y, label)
+    for upper, lower in zip(centers, centers[1:]):
+        _arrow(d, WIDTH / 2, upper[0][1] - BOX_H / 2, WIDTH / 2, lower[0][1] + BOX_H / 2, ACCENT)
+
+
+def _layout_sequence(d, nodes):
+    participants = nodes[:min(4, max(2, len(nodes) // 2))]
+    messages = nodes[len(participants):] or participants[1:]
+    xs = [WIDTH * (i + 0.5) / len(participants) for i in range(len(participants))]
+    top = HEIGHT - 70
+    for x, label in zip(xs, participants):
+        _box(d, x, top, label, w=130)
+        d.add(Line(x, top - BOX_H / 2, x, 20, strokeColor=colors.grey, strokeDashArray=[4, 3]))
+    step = (top - 60) / max(len(messages), 1)
+    for i, label in enumerate(messages):
+        src, dst = i % len(xs), (i + 1) % len(xs)
+        y = top - 50 - step * i
+        _arrow(d, xs[src], y, xs[dst], y)
+        d.add(String((xs[src] + xs[dst]) / 2, y + 4, label[:32], fontName="Helvetica", fontSize=8, textAnchor="middle"))
+
+
+def _layout_radial(d, nodes, title, ring_links):
+    cx, cy = WIDTH / 2, HEIGHT / 2 - 10
+    radius = min(WIDTH, HEIGHT) / 2 - 50
+    points = [(cx + radius * 1.35 * math.cos(2 * math.pi * i / len(nodes)),
+               cy + radius * math.sin(2 * math.pi * i / len(nodes))) for i in range(len(nodes))]
+    for x, y in points:
+        d.add(Line(cx, cy, x, y, strokeColor=STROKE))
+    if ring_links:
+        for (x1, y1), (x2, y2) in zip(points, points[1:] + points[:1]):
+            d.add(Line(x1, y1, x2, y2, strokeColor=ACCENT, strokeDashArray=[3, 3]))
+    d.add(Circle(cx, cy, 48, fillColor=STROKE, strokeColor=ACCENT))
+    for i, line in enumerate(_wrap(title, 16)):
+        d.add(String(cx, cy + 2 - 12 * i, line, fontName="Helvetica-Bold", fontSize=9, fillColor=colors.white, textAnchor="middle"))
+    for (x, y), label in zip(points, nodes):
+        _box(d, x, y, label, w=130, h=38)
+
+
+def _layout_er(d, nodes):
+    cols = 3
+    points = []
+    for i in range(len(nodes)):
+        row, col = divmod(i, cols)
+        points.append((WIDTH * (col + 0.5) / cols, HEIGHT - 80 - row * 110))
+    for i, (x, y) in enumerate(points):
+        if i % cols and i - 1 >= 0:
+            px, py = points[i - 1]
+            d.add(Line(px + BOX_W / 2, py, x - BOX_W / 2, y, strokeColor=STROKE))
+        if i >= cols:
+            px, py = points[i - cols]
+            d.add(Line(px, py - BOX_H / 2, x, y + BOX_H / 2, strokeColor=STROKE))
+    for (x, y), label in zip(points, nodes):
+        d.add(Rect(x - BOX_W / 2, y + BOX_H / 2 - 14, BOX_W, 14, fillColor=STROKE, strokeColor=STROKE))
+        _box(d, x, y - 7, label, h=BOX_H - 14)
+
+
+def build_drawing(spec: dict) -> Drawing:
+    """Lay out a diagram spec (see extract_structure) as a reportlab Drawing."""
+    d = Drawing(WIDTH, HEIGHT)
+    d.add(Rect(0, 0, WIDTH, HEIGHT, fillColor=colors.white, strokeColor=None))
+    nodes = spec["nodes"] or [spec["title"]]
+    diagram_type = spec["type"]
+    if diagram_type in ("mindmap", "network"):
+        _layout_radial(d, nodes, spec["title"], ring_links=diagram_type == "network")
+    else:
+        d.add(String(WIDTH / 2, HEIGHT - 22, spec["title"], fontName="Helvetica-Bold", fontSize=13, textAnchor="middle"))
+        if diagram_type == "flow":
+            _layout_flow(d, nodes)
+        elif diagram_type == "sequence":
+            _layout_sequence(d, nodes)
+        elif diagram_type == "er-diagram":
+            _layout_er(d, nodes)
+        else:
+            _layout_architecture(d, nodes)
+    return d
+
+
+def _pil_color(color, default=None):
+    if color is None:
+        return default
+    return tuple(int(round(c * 255)) for c in color.rgb())
+
+
+def _render_png_pillow(drawing: Drawing, path: str, scale: int = 2):
+    """
+    Rasterize the shapes build_drawing uses with Pillow (a reportlab dependency).
+
+    Fallback for hosts without the optional renderPM backend, which needs cairo.
+    """
+    from PIL import Image, ImageDraw, ImageFont
+
+    image = Image.new("RGB", (int(drawing.width * scale), int(drawing.height * scale)), "white")
+    draw = ImageDraw.Draw(image)
+
+    def pt(x, y):
+        return (x * scale, (drawing.height - y) * scale)
+
+    for shape in drawing.contents:
+        width = max(1, int(getattr(shape, "strokeWidth", 1) * scale))
+        if isinstance(shape, Rect):
+            x0, y0 = pt(shape.x, shape.y + shape.height)
+            x1, y1 = pt(shape.x + shape.width, shape.y)
+            draw.rounded_rectangle([x0, y0, x1, y1], radius=(shape.rx or 0) * scale,
+                                   fill=_pil_color(shape.fillColor), outline=_pil_color(shape.strokeColor), width=width)
+        elif isinstance(shape, Circle):
+            x0, y0 = pt(shape.cx - shape.r, shape.cy + shape.r)
+            x1, y1 = pt(shape.cx + shape.r, shape.cy - shape.r)
+            draw.ellipse([x0, y0, x1, y1], fill=_pil_color(shape.fillColor), outline=_pil_color(shape.strokeColor), width=width)
+        elif isinstance(shape, Line):
+            draw.line([pt(shape.x1, shape.y1), pt(shape.x2, shape.y2)], fill=_pil_color(shape.strokeColor, (0, 0, 0)), width=width)
+        elif isinstance(shape, Polygon):
+            points = [pt(x, y) for x, y in zip(shape.points[::2], shape.points[1::2])]
+            draw.polygon(points, fill=_pil_color(shape.fillColor), outline=_pil_color(shape.strokeColor))
+        elif isinstance(shape, String):
+            font = ImageFont.load_default(size=shape.fontSize * scale)
+            anchor = {"middle": "ms", "end": "rs"}.get(shape.textAnchor, "ls")
+            draw.text(pt(shape.x, shape.y), shape.text, fill=_pil_color(shape.fillColor, (0, 0, 0)), font=font, anchor=anchor)
+    image.save(path, "PNG")
+
+
+def _render_files(spec: dict, stem: str) -> dict:
+    """
+    Render one spec to SVG and, if a raster backend is available, PNG. Runs in the pool.
+
+    The spec's .json is written last: its presence means every other file of
+    the diagram is complete (generate_diagram treats it as the cache marker).
+    """
+    drawing = build_drawing(spec)
+    files = {}
+    with atomic_output(f"{stem}.svg") as path:
+        renderSVG.drawToFile(drawing, path)
+        with open(path, "rb") as f:
+            svg_bytes = f.read()
+    files["svg"] = f"{stem}.svg"
+    # Precompressed sibling for /download clients that accept gzip
+    with atomic_output(f"{stem}.svg.gz") as path:
+        with open(path, "wb") as f:
+            f.write(gzip.compress(svg_bytes, 9))
+    with atomic_output(f"{stem}.png") as path:
+        try:
+            from reportlab.graphics import renderPM
+            renderPM.drawToFile(drawing, path, fmt="PNG", dpi=144)
+        except Exception:
+            # renderPM needs the optional rlPyCairo/cairo backend
+            _render_png_pillow(drawing, path)
+    files["png"] = f"{stem}.png"
+    with atomic_output(f"{stem}.json") as path:
+        with open(path, "w") as f:
+            json.dump(spec, f)
+    return files
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                workers = int(os.getenv("MCP_RENDER_WORKERS", min(4, os.cpu_count() or 1)))
+                # spawn: the server process is multi-threaded, forking it is not safe
+                _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+                logger.info(f"Started diagram render pool with {workers} workers")
+    return _pool
+
+
+def _discard_pool(pool):
+    """Drop a broken pool so the next _get_pool() starts a fresh one (unless another thread already did)."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _render_in_pool(spec: dict, stem: str):
+    # A worker that died (OOM kill, crash in a native renderer) breaks the
+    # whole pool; it is replaced once rather than failing every later render
+    for attempt in range(2):
+        pool = _get_pool()
+        budget = remaining_budget()
+        try:
+            future = pool.submit(_render_files, spec, stem)
+            return future.result(timeout=max(min(RENDER_TIMEOUT, budget), 0))
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            if attempt:
+                raise
+            logger.warning(f"Diagram render pool broke while rendering {stem}, restarting it")
+        except TimeoutError:
+            # Frees the pool slot if the render has not started; a running one
+            # finishes in its worker and is a cache hit next time
+            future.cancel()
+            if budget < RENDER_TIMEOUT:
+                raise DeadlineExceeded(f"No time left to render diagram {stem} within the request's deadline")
+            raise TimeoutError(f"Rendering diagram {stem} took longer than {RENDER_TIMEOUT}s")
+
+
+def diagram_stem(spec: dict) -> str:
+    digest = hashlib.sha256(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return f"diagrams/{spec['type']}_{digest}"
+
+
+def diagram_file(diagram_url: str, extension: str):
+    """Path of a sibling file (``.json``, ``.png``, ...) of a rendered diagram, or None if the URL is not one of ours."""
+    match = DIAGRAM_URL_PATTERN.fullmatch(diagram_url or "")
+    if match is None:
+        return None
+    path = os.path.realpath(output_path(f"{match.group(1)}.{extension}"))
+    if not path.startswith(os.path.realpath(OUTPUTS_DIR) + os.sep):
+        return None
+    return path
+
+
+def load_spec(diagram_url: str):
+    """Return the spec stored next to a rendered diagram, or None if it is not one of ours."""
+    path = diagram_file(diagram_url, "json")
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
 def generate_diagram(context_text: str, diagram_type: str = "architecture"):
-    return {"diagram_url": f"https://placeholder-diagrams.com/{diagram_type}.png"}
\ No newline at end of file
+    logger.info(f"Starting diagram generation. Type: {diagram_type}, context length: {len(context_text)} chars")
+    start_time = datetime.now()
+
+    if diagram_type not in DIAGRAM_TYPES:
+        raise ValueError(f"Unsupported diagram type: {diagram_type}. Expected one of {DIAGRAM_TYPES}")
+
+    spec = extract_structure(context_text, diagram_type)
+    stem = diagram_stem(spec)
+
+    # Content-addressed: identical structure means identical image, on any worker
+    # The .json is written last, so an interrupted render is not taken for a hit
+    png_path = output_path(f"{stem}.png")
+    if os.path.exists(output_path(f"{stem}.json")):
+        logger.info(f"Diagram cache hit: {stem}")
+    else:
+        check_cancelled()
+        _render_in_pool(spec, stem)
+
+    elapsed = (datetime.now() - start_time).total_seconds()
+    logger.info(f"Diagram {stem} ready in {elapsed:.2f}s with {len(spec['nodes'])} nodes")
+
+    svg_url = output_url(f"{stem}.svg")
+    return {
+        "diagram_url": output_url(f"{stem}.png") if os.path.exists(png_path) else svg_url,
+        "diagram_svg_url": svg_url
+    }
@@ -0,0 +1,60 @@
+"""
+Payload size and encode/decode time of the /jsonrpc wire formats.
+
+    python benchmark_wire.py                         # synthetic 3-hour transcript
+    python benchmark_wire.py outputs/transcripts/ID.yts
+
+Formats that need a missing optional package (msgpack, zstandard) are skipped.
+"""
+import random
+import re
+import sys
+import time
+
+import wire
+from segments import TranscriptSegments
+
+
+def synthetic_transcript(minutes: int = 180) -> str:
+    """Spoken-length text with a realistic vocabulary (words sampled from stdlib sources)."""
+    import collections, inspect, threading
+    random.seed(0)
+    words = re.findall(r"[a-z]{2,}", " ".join(inspect.getsource(m) for m in (collections, threading)).lower())
+    # Roughly 150 spoken words per minute
+    return " ".join(random.choice(words) for _ in range(minutes * 150))
+
+
+def _time(func, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "rb") as f:
+            text = TranscriptSegments.from_bytes(f.read()).text
+    else:
+        text = synthetic_transcript()
+    # The largest message the pipeline sends: BlogAgent's call with the transcript
+    payload = {"jsonrpc": "2.0", "id": 1, "method": "call_tool",
+               "params": {"tool": "BlogAgent.generate_blog", "inputs": {"clean_transcript": text, "tone": "educational"}}}
+    print(f"Transcript: {len(text):,} chars\n")
+    print(f"{'format':<10}{'coding':<10}{'bytes':>12}{'ratio':>8}{'encode ms':>12}{'decode ms':>12}")
+    baseline = None
+    formats = [wire.JSON_TYPE] + ([wire.MSGPACK_TYPES[0]] if wire.msgpack else [])
+    for content_type in formats:
+        for coding in [None] + wire.content_codings():
+            body, headers = wire.encode_body(payload, content_type, coding)
+            baseline = baseline or len(body)
+            encode_ms = _time(lambda: wire.encode_body(payload, content_type, coding))
+            decode_ms = _time(lambda: wire.decode_body(body, content_type, headers.get("Content-Encoding")))
+            print(f"{content_type.split('/')[-1]:<10}{headers.get('Content-Encoding', 'identity'):<10}{len(body):>12,}"
+                  f"{len(body) / baseline:>8.2f}{encode_ms:>12.2f}{decode_ms:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
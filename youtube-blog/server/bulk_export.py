@@ -0,0 +1,243 @@
+import json
+import logging
+import os
+import re
+import time
+import zipfile
+from datetime import datetime
+
+from library import blog_hash, get_library
+from request_context import set_context
+from storage import output_path
+
+logger = logging.getLogger(__name__)
+
+# Largest batch one /export request may name, and the read size for copying files into the archive
+MAX_BLOGS = int(os.getenv("MCP_BULK_EXPORT_MAX", "200"))
+CHUNK_SIZE = 64 * 1024
+FILE_TYPES = ("docx", "pdf", "md")
+# DOCX files are zip archives already; deflating them again only costs CPU
+STORED_TYPES = ("docx",)
+
+
+class _ChunkSink:
+    """
+    Write-only file object for zipfile/reportlab output.
+
+    It has no tell()/seek(), so ZipFile writes in streaming mode (sizes in data
+    descriptors after each member) and the caller hands out each drained chunk
+    as soon as it is written.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        chunks, self.chunks = self.chunks, []
+        return b"".join(chunks)
+
+
+def parse_request(request) -> tuple:
+    """
+    Validate an /export body and return (items, include).
+
+    ``blogs`` lists videos (URL or ID, optionally ``{"video": ..., "tone": ...}``)
+    whose newest blog is taken from the library, or ``{"blog_markdown": ...,
+    "diagram_url": ...}`` for text the caller already has. ``include`` picks the
+    files per blog in a ZIP (default all of docx, pdf, md).
+    """
+    if not isinstance(request, dict):
+        raise ValueError("Request body must be a JSON object")
+    items = request.get("blogs")
+    if not isinstance(items, list) or not items:
+        raise ValueError("'blogs' must be a non-empty list")
+    if len(items) > MAX_BLOGS:
+        raise ValueError(f"At most {MAX_BLOGS} blogs per export, got {len(items)}")
+    for i, item in enumerate(items, 1):
+        if isinstance(item, str):
+            continue
+        if not isinstance(item, dict) or not (item.get("video") or item.get("blog_markdown")):
+            raise ValueError(f"blogs[{i}]: expected a video URL/ID or an object with 'video' or 'blog_markdown'")
+    include = request.get("include") or list(FILE_TYPES)
+    unknown = [kind for kind in include if kind not in FILE_TYPES]
+    if unknown:
+        raise ValueError(f"Unknown file types {unknown}, expected some of {list(FILE_TYPES)}")
+    return [{"video": item} if isinstance(item, str) else item for item in items], include
+
+
+def _local_path(url: str):
+    return output_path(url.replace("outputs/", "", 1)) if url else None
+
+
+def _describe(item: dict) -> str:
+    if item.get("video"):
+        return item["video"] + (f" ({item['tone']})" if item.get("tone") else "")
+    return f"blog {blog_hash(item['blog_markdown'])[:12]}"
+
+
+def _resolve(item: dict, export: bool = True) -> dict:
+    """
+    Library entry (with markdown) for one requested blog.
+
+    With ``export``, the DOCX/PDF come from the library when it holds an export
+    of this text with the same diagram whose files are still in the outputs
+    directory; otherwise export_blog renders them now (and records the new
+    URLs, so the next export reuses them).
+    """
+    library = get_library()
+    if item.get("blog_markdown"):
+        markdown = item["blog_markdown"]
+        diagram_url = item.get("diagram_url")
+        # The library only returns file URLs for an export with exactly this diagram
+        entry = library.get(blog_hash(markdown), diagram_url) or {
+            "blog_markdown": markdown, "video_id": item.get("video_id"), "tone": item.get("tone"), "diagram_url": diagram_url}
+    else:
+        from agents.transcript_agent import extract_video_id
+        video_id = extract_video_id(item["video"])
+        tone = item.get("tone")
+        # An export that still has its files, else the newest draft (without file URLs)
+        entry = library.find_existing(video_id, tone) or library.find_existing(video_id, tone, exported_only=False)
+        if entry is None:
+            raise LookupError(f"No blog in the library for video {video_id}" + (f" with tone {tone}" if tone else ""))
+    entry["reused"] = True
+    if export and not (entry.get("docx_url") and entry.get("pdf_url")):
+        from agents.exporter_agent import export_blog
+        entry.update(export_blog(entry["blog_markdown"], diagram_url=entry.get("diagram_url")))
+        entry["reused"] = False
+    return entry
+
+
+def _out_of_time(ctx) -> bool:
+    """True once the export's deadline passed or it was cancelled; otherwise makes ctx current for the next blog."""
+    if ctx is None:
+        return False
+    # Each step of the generator may run on another pool thread
+    set_context(ctx)
+    return ctx.cancelled or ctx.remaining() <= 0
+
+
+def _archive_name(index: int, entry: dict) -> str:
+    label = entry.get("video_id") or blog_hash(entry["blog_markdown"])[:12]
+    if entry.get("tone"):
+        label += f"_{entry['tone']}"
+    return f"{index:03d}_" + re.sub(r"[^A-Za-z0-9_-]+", "-", label)
+
+
+def _add_file(archive: zipfile.ZipFile, sink: _ChunkSink, path: str, arcname: str):
+    info = zipfile.ZipInfo.from_file(path, arcname)
+    info.compress_type = zipfile.ZIP_STORED if arcname.rsplit(".", 1)[-1] in STORED_TYPES else zipfile.ZIP_DEFLATED
+    with open(path, "rb") as source, archive.open(info, "w") as target:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+            target.write(chunk)
+            data = sink.drain()
+            if data:
+                yield data
+
+
+def stream_zip(items: list, include=FILE_TYPES, ctx=None):
+    """
+    Yield a ZIP archive of the requested blogs piece by piece while it is built.
+
+    Blogs are resolved (and rendered if needed) one at a time, and each file is
+    copied in CHUNK_SIZE pieces, so memory stays at about one chunk whatever
+    the batch size, and nothing is written to disk besides the exports
+    themselves. The response has started by the time a blog fails, so a blog
+    that cannot be resolved is listed in the archive's manifest.json instead of
+    an HTTP error. Every file of a blog is located before its first member is
+    written; a failure after that would leave a truncated member, so the
+    stream is aborted instead. Blogs not reached before ``ctx``'s deadline
+    are listed as errors too.
+    """
+    start_time = datetime.now()
+    sink = _ChunkSink()
+    manifest = {"created_at": time.time(), "blogs": [], "errors": []}
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for index, item in enumerate(items, 1):
+            if _out_of_time(ctx):
+                manifest["errors"] += [{"index": i, "blog": _describe(rest), "error": "deadline exceeded"}
+                                       for i, rest in enumerate(items[index - 1:], index)]
+                break
+            try:
+                entry = _resolve(item, export="docx" in include or "pdf" in include)
+                name = _archive_name(index, entry)
+                paths = {kind: _local_path(entry[f"{kind}_url"]) for kind in ("docx", "pdf") if kind in include}
+                missing = [entry[f"{kind}_url"] for kind, path in paths.items() if not os.path.isfile(path)]
+                if missing:
+                    raise FileNotFoundError(f"Export files missing: {missing}")
+            except Exception as e:
+                logger.warning(f"Bulk export skipped {_describe(item)}: {e}")
+                manifest["errors"].append({"index": index, "blog": _describe(item), "error": str(e)})
+                continue
+            files = []
+            try:
+                if "md" in include:
+                    archive.writestr(f"{name}.md", entry["blog_markdown"])
+                    files.append(f"{name}.md")
+                    yield sink.drain()
+                for kind, path in paths.items():
+                    yield from _add_file(archive, sink, path, f"{name}.{kind}")
+                    files.append(f"{name}.{kind}")
+            except Exception as e:
+                logger.error(f"Bulk export aborted while writing {_describe(item)}: {e}", exc_info=True)
+                raise
+            manifest["blogs"].append({"index": index, "files": files, "reused": entry["reused"],
+                                      **{key: entry.get(key) for key in ("video_id", "tone", "title", "docx_url", "pdf_url")}})
+        archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+    yield sink.drain()
+    elapsed = (datetime.now() - start_time).total_seconds()
+    logger.info(f"Bulk export streamed {len(manifest['blogs'])} blogs ({len(manifest['errors'])} skipped) in {elapsed:.2f}s")
+
+
+def stream_combined_pdf(items: list, ctx=None):
+    """
+    Yield one PDF with every requested blog, each starting on a new page with an outline entry.
+
+    The pages are drawn straight from the markdown and diagram specs, like
+    export_blog does, rather than merging the per-blog PDFs. reportlab only
+    writes the document out on save, so unlike the ZIP this holds the finished
+    PDF in memory before it is sent.
+    """
+    from reportlab.pdfgen import canvas
+    from agents.exporter_agent import draw_pdf_pages
+    from agents.visual_agent import load_spec
+
+    start_time = datetime.now()
+    sink = _ChunkSink()
+    c = canvas.Canvas(sink)
+    c.setTitle(f"{len(items)} blogs")
+    c.showOutline()
+    included, errors = 0, []
+    for index, item in enumerate(items, 1):
+        if _out_of_time(ctx):
+            errors += [f"{_describe(rest)}: deadline exceeded" for rest in items[index - 1:]]
+            break
+        try:
+            entry = _resolve(item, export=False)
+        except Exception as e:
+            logger.warning(f"Combined PDF skipped {_describe(item)}: {e}")
+            errors.append(f"{_describe(item)}: {e}")
+            continue
+        spec = load_spec(entry["diagram_url"]) if entry.get("diagram_url") else None
+        key = f"blog{index}"
+        c.bookmarkPage(key)
+        c.addOutlineEntry(entry.get("title") or _describe(item), key, level=0)
+        draw_pdf_pages(c, entry["blog_markdown"], spec)
+        c.showPage()
+        included += 1
+    if errors:
+        c.bookmarkPage("skipped")
+        c.addOutlineEntry("Not included", "skipped", level=0)
+        draw_pdf_pages(c, "Not included in this export:\n" + "\n".join(errors))
+    c.save()
+    data = sink.drain()
+    for offset in range(0, len(data), CHUNK_SIZE):
+        yield data[offset:offset + CHUNK_SIZE]
+    elapsed = (datetime.now() - start_time).total_seconds()
+    logger.info(f"Combined PDF of {included} blogs ({len(errors)} skipped, {len(data)} bytes) built in {elapsed:.2f}s")
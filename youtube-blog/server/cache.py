@@ -0,0 +1,109 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+from storage import CACHE_PATH
+
+logger = logging.getLogger(__name__)
+
+
+class SharedCache:
+    """
+    Small key/value cache shared by every worker process on a node.
+
+    Backed by SQLite in WAL mode so concurrent uvicorn/gunicorn workers can read
+    and write safely without running a separate Redis. Values are stored as JSON.
+    """
+
+    def __init__(self, path: str = CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        conn.commit()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace: str, key: str, default=None):
+        row = self._connect().execute(
+            "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+            (namespace, key)
+        ).fetchone()
+        if row is None:
+            return default
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            self.delete(namespace, key)
+            return default
+        return json.loads(value)
+
+    def set(self, namespace: str, key: str, value, ttl: float = None):
+        expires_at = time.time() + ttl if ttl else None
+        self._connect().execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value), expires_at)
+        )
+
+    def delete(self, namespace: str, key: str):
+        self._connect().execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """
+        Take or renew the lease ``name`` for ``owner``; True if ``owner`` holds it afterwards.
+
+        Elects one worker on the node for background jobs. A lease lapses ``ttl``
+        seconds after its last renewal, so another worker takes over if the
+        holder dies.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = 'lease' AND key = ?", (name,)
+            ).fetchone()
+            if row is not None and json.loads(row[0]) != owner and row[1] is not None and row[1] > now:
+                conn.execute("COMMIT")
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES ('lease', ?, ?, ?)",
+                (name, json.dumps(owner), now + ttl)
+            )
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> SharedCache:
+    """Return the process-wide SharedCache, creating it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SharedCache()
+                logger.info(f"Shared cache opened at {_cache.path}")
+    return _cache
@@ -0,0 +1,112 @@
+"""
+Record/replay of the pipeline's external calls (YouTube transcripts, LLM completions).
+
+Set MCP_CASSETTE_MODE=record on the chatbot/client and the server to capture
+every call into one SQLite cassette, then MCP_CASSETTE_MODE=replay to serve
+them back without network access. Calls are keyed by a hash of their request,
+so a replayed run must make the same requests (same video, prompts, model).
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+MODE = os.getenv("MCP_CASSETTE_MODE", "off")  # off | record | replay
+CASSETTE_PATH = os.path.abspath(os.getenv(
+    "MCP_CASSETTE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "cassette.sqlite3")))
+
+
+class CassetteMiss(Exception):
+    """Raised in replay mode for a call that was never recorded."""
+
+
+def _pack(value) -> bytes:
+    return zlib.compress(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+
+
+def _unpack(data: bytes):
+    return json.loads(zlib.decompress(data))
+
+
+class Cassette:
+    """
+    SQLite-backed store of recorded calls, shared by every process pointed at the same file.
+
+    The file is only opened (and created) by the first recorded or replayed
+    call, so with the mode off nothing touches the disk.
+    """
+
+    def __init__(self, path: str = CASSETTE_PATH, mode: str = MODE):
+        self.path = path
+        self.mode = mode
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS calls ("
+                " key TEXT PRIMARY KEY,"
+                " kind TEXT NOT NULL,"
+                " request BLOB NOT NULL,"
+                " response BLOB NOT NULL,"
+                " elapsed REAL,"
+                " recorded_at REAL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(kind: str, request: dict) -> str:
+        canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(f"{kind}\n{canonical}".encode("utf-8")).hexdigest()
+
+    def call(self, kind: str, request: dict, func):
+        """
+        Return ``func()`` (a JSON-serializable result), recording or replaying it per the mode.
+
+        ``request`` must identify the call completely; it is hashed into the key.
+        """
+        if self.mode not in ("record", "replay"):
+            return func()
+        key = self.key(kind, request)
+        if self.mode == "replay":
+            row = self._connect().execute("SELECT response FROM calls WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                raise CassetteMiss(f"No recorded {kind} call for key {key[:12]} in {self.path}")
+            logger.info(f"Replayed {kind} call {key[:12]}")
+            return _unpack(row[0])
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        self._connect().execute(
+            "INSERT OR REPLACE INTO calls (key, kind, request, response, elapsed, recorded_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, kind, _pack(request), _pack(result), elapsed, time.time())
+        )
+        logger.info(f"Recorded {kind} call {key[:12]} ({elapsed:.2f}s)")
+        return result
+
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette() -> Cassette:
+    """Return the process-wide Cassette for MCP_CASSETTE / MCP_CASSETTE_MODE."""
+    global _cassette
+    if _cassette is None:
+        with _cassette_lock:
+            if _cassette is None:
+                _cassette = Cassette()
+                if _cassette.mode != "off":
+                    logger.info(f"Cassette {_cassette.mode} mode, file {_cassette.path}")
+    return _cassette
@@ -0,0 +1,11 @@
+# Gunicorn config for running the MCP server on every core of a node:
+#   cd server && gunicorn -c gunicorn.conf.py server:app
+import os
+
+bind = f"{os.getenv('MCP_HOST', '0.0.0.0')}:{os.getenv('MCP_PORT', '8000')}"
+workers = int(os.getenv("MCP_WORKERS", os.cpu_count() or 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Blog generation can legitimately take minutes
+timeout = int(os.getenv("MCP_WORKER_TIMEOUT", "900"))
+graceful_timeout = 30
+accesslog = "-"
@@ -0,0 +1,264 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from storage import LIBRARY_PATH, output_path
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS transcripts ("
+    " transcript_hash TEXT PRIMARY KEY,"
+    " video_id TEXT,"
+    " chars INTEGER,"
+    " created_at REAL)",
+    "CREATE INDEX IF NOT EXISTS transcripts_video ON transcripts (video_id)",
+    "CREATE TABLE IF NOT EXISTS blogs ("
+    " id INTEGER PRIMARY KEY,"
+    " blog_hash TEXT UNIQUE NOT NULL,"
+    " video_id TEXT,"
+    " tone TEXT,"
+    " transcript_hash TEXT,"
+    " title TEXT,"
+    " created_at REAL)",
+    "CREATE INDEX IF NOT EXISTS blogs_video ON blogs (video_id, tone)",
+    # One row per exported conversion: the same text exported with another
+    # diagram (or none, stored as '') is a different set of files
+    "CREATE TABLE IF NOT EXISTS exports ("
+    " blog_id INTEGER NOT NULL,"
+    " diagram_url TEXT NOT NULL DEFAULT '',"
+    " docx_url TEXT,"
+    " pdf_url TEXT,"
+    " exported_at REAL,"
+    " PRIMARY KEY (blog_id, diagram_url))",
+    # Full-text search; rowid is blogs.id / transcripts.rowid
+    "CREATE VIRTUAL TABLE IF NOT EXISTS blogs_fts USING fts5(title, body)",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS transcripts_fts USING fts5(body)",
+]
+
+SCHEMA_VERSION = 1
+BLOG_COLUMNS = ("video_id", "tone", "transcript_hash", "title", "docx_url", "pdf_url", "diagram_url", "created_at", "exported_at")
+# A blog with its exports (LEFT JOIN: blogs never exported have NULL file columns)
+BLOG_SELECT = ("SELECT blogs.*, exports.docx_url, exports.pdf_url, NULLIF(exports.diagram_url, '') AS diagram_url,"
+               " exports.exported_at{extra} FROM blogs LEFT JOIN exports ON exports.blog_id = blogs.id")
+LATEST_EXPORT = " AND exports.exported_at = (SELECT MAX(exported_at) FROM exports WHERE blog_id = blogs.id)"
+
+
+def blog_hash(blog_markdown: str) -> str:
+    return hashlib.sha256(blog_markdown.encode("utf-8")).hexdigest()
+
+
+def _files_exist(entry: dict) -> bool:
+    """True when the entry's DOCX and PDF are still in the outputs directory."""
+    return all(entry.get(key) and os.path.isfile(output_path(entry[key].replace("outputs/", "", 1)))
+               for key in ("docx_url", "pdf_url"))
+
+
+def _title(blog_markdown: str) -> str:
+    for line in blog_markdown.splitlines():
+        if line.strip():
+            return line.strip().lstrip("#").strip()[:200]
+    return ""
+
+
+class Library:
+    """
+    SQLite FTS5 index of the transcripts and blogs the agents produced.
+
+    BlogAgent records each transcript and each blog it returns (keyed by the
+    content hash of the markdown); ExporterAgent records the DOCX/PDF URLs per
+    blog, one row per diagram they were exported with. Shared by every worker
+    on the node, like the SharedCache.
+    """
+
+    def __init__(self, path: str = LIBRARY_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def record_transcript(self, transcript_hash: str, video_id: str, text: str):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO transcripts (transcript_hash, video_id, chars, created_at) VALUES (?, ?, ?, ?)",
+                (transcript_hash, video_id, len(text), time.time())
+            )
+            if cursor.rowcount:
+                conn.execute("INSERT INTO transcripts_fts (rowid, body) VALUES (?, ?)", (cursor.lastrowid, text))
+            elif video_id:
+                conn.execute("UPDATE transcripts SET video_id = ? WHERE transcript_hash = ? AND video_id IS NULL",
+                             (video_id, transcript_hash))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def record_blog(self, blog_markdown: str, video_id: str = None, tone: str = None, transcript_hash: str = None,
+                    docx_url: str = None, pdf_url: str = None, diagram_url: str = None):
+        """
+        Insert or update the entry for this exact blog text; None fields keep their stored value.
+
+        DOCX/PDF URLs are recorded as the export of this text with ``diagram_url``
+        (None: without a diagram), replacing only an earlier export with the same diagram.
+        """
+        key = blog_hash(blog_markdown)
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT id FROM blogs WHERE blog_hash = ?", (key,)).fetchone()
+            if row is None:
+                title = _title(blog_markdown)
+                blog_id = conn.execute(
+                    "INSERT INTO blogs (blog_hash, video_id, tone, transcript_hash, title, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, video_id, tone, transcript_hash, title, now)
+                ).lastrowid
+                conn.execute("INSERT INTO blogs_fts (rowid, title, body) VALUES (?, ?, ?)", (blog_id, title, blog_markdown))
+            else:
+                blog_id = row["id"]
+                conn.execute(
+                    "UPDATE blogs SET video_id = COALESCE(?, video_id), tone = COALESCE(?, tone),"
+                    " transcript_hash = COALESCE(?, transcript_hash) WHERE id = ?",
+                    (video_id, tone, transcript_hash, blog_id)
+                )
+            if docx_url or pdf_url:
+                conn.execute(
+                    "INSERT OR REPLACE INTO exports (blog_id, diagram_url, docx_url, pdf_url, exported_at) VALUES (?, ?, ?, ?, ?)",
+                    (blog_id, diagram_url or "", docx_url, pdf_url, now)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _entry(self, row) -> dict:
+        return {column: row[column] for column in BLOG_COLUMNS}
+
+    def lookup(self, video_id: str, tone: str = None) -> list:
+        """All blogs for a video (optionally one tone), one entry per export, newest first."""
+        query = BLOG_SELECT.format(extra="") + " WHERE video_id = ?" + (" AND tone = ?" if tone else "")
+        query += " ORDER BY blogs.created_at DESC, exports.exported_at DESC"
+        return [self._entry(row) for row in self._connect().execute(query, (video_id, tone) if tone else (video_id,))]
+
+    def find_existing(self, video_id: str, tone: str = None, need_diagram: bool = False, exported_only: bool = True):
+        """
+        The newest exported blog for a video (and tone), with its markdown, or None.
+
+        Only exports whose DOCX and PDF are still in the outputs directory count:
+        a finished conversion the caller can hand back instead of running the
+        pipeline again. With ``exported_only=False`` the newest blog is returned
+        when there is no such export, with its file URLs cleared.
+        """
+        query = (BLOG_SELECT.format(extra=", blogs_fts.body AS blog_markdown")
+                 + " JOIN blogs_fts ON blogs_fts.rowid = blogs.id WHERE video_id = ?")
+        args = [video_id]
+        if tone:
+            query += " AND tone = ?"
+            args.append(tone)
+        rows = self._connect().execute(query + " ORDER BY exports.exported_at DESC", args).fetchall()
+        entries = [dict(self._entry(row), blog_markdown=row["blog_markdown"]) for row in rows]
+        for entry in entries:
+            if entry["exported_at"] is not None and (entry["diagram_url"] or not need_diagram) and _files_exist(entry):
+                return entry
+        if exported_only or not entries:
+            return None
+        newest = max(entries, key=lambda entry: entry["created_at"])
+        return dict(newest, docx_url=None, pdf_url=None, diagram_url=None, exported_at=None)
+
+    def get(self, key: str, diagram_url: str = None):
+        """
+        The entry for one blog by its content hash (see blog_hash), with its markdown, or None.
+
+        The file URLs are those of its export with exactly ``diagram_url`` (None:
+        without a diagram); they are None when there is no such export or its files are gone.
+        """
+        conn = self._connect()
+        row = conn.execute(
+            BLOG_SELECT.format(extra=", blogs_fts.body AS blog_markdown").replace(
+                "exports.blog_id = blogs.id", "exports.blog_id = blogs.id AND exports.diagram_url = ?")
+            + " JOIN blogs_fts ON blogs_fts.rowid = blogs.id WHERE blog_hash = ?", (diagram_url or "", key)
+        ).fetchone()
+        if row is None:
+            return None
+        entry = dict(self._entry(row), blog_markdown=row["blog_markdown"], diagram_url=diagram_url)
+        if not _files_exist(entry):
+            entry.update(docx_url=None, pdf_url=None, exported_at=None)
+        return entry
+
+    def search(self, query: str, limit: int = 20) -> list:
+        """
+        Full-text search over blog titles and text (FTS5 query syntax), best match first.
+
+        Transcript matches for videos without a blog are returned too, with only
+        video_id set, so "was this ever fetched?" is answerable as well.
+        """
+        conn = self._connect()
+        results = [
+            dict(self._entry(row), snippet=row["snippet"])
+            for row in conn.execute(
+                BLOG_SELECT.format(extra=", snippet(blogs_fts, 1, '[', ']', '...', 16) AS snippet") + LATEST_EXPORT
+                + " JOIN blogs_fts ON blogs_fts.rowid = blogs.id WHERE blogs_fts MATCH ? ORDER BY rank LIMIT ?",
+                (query, limit)
+            )
+        ]
+        seen = {entry["video_id"] for entry in results}
+        for row in conn.execute(
+            "SELECT transcripts.video_id, transcripts.transcript_hash, snippet(transcripts_fts, 0, '[', ']', '...', 16) AS snippet"
+            " FROM transcripts_fts JOIN transcripts ON transcripts.rowid = transcripts_fts.rowid"
+            " WHERE transcripts_fts MATCH ? ORDER BY rank LIMIT ?",
+            (query, limit)
+        ):
+            if len(results) >= limit:
+                break
+            if row["video_id"] not in seen:
+                seen.add(row["video_id"])
+                results.append(dict({column: None for column in BLOG_COLUMNS}, video_id=row["video_id"],
+                                    transcript_hash=row["transcript_hash"], snippet=row["snippet"]))
+        return results
+
+
+_library = None
+_library_lock = threading.Lock()
+
+
+def get_library() -> Library:
+    """Return the process-wide Library, creating it on first use."""
+    global _library
+    if _library is None:
+        with _library_lock:
+            if _library is None:
+                _library = Library()
+                logger.info(f"Library index opened at {_library.path}")
+    return _library
+
+
+def index_safely(func, *args, **kwargs):
+    """Run an indexing call without letting an index problem fail the tool that produced the content."""
+    try:
+        func(get_library(), *args, **kwargs)
+    except Exception as e:
+        logger.warning(f"Library indexing failed: {e}")
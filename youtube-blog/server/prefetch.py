@@ -0,0 +1,168 @@
+import logging
+import os
+import socket
+import threading
+import time
+import urllib.request
+import xml.etree.ElementTree as ET
+from collections import deque
+from datetime import datetime
+
+from cache import get_cache
+
+logger = logging.getLogger(__name__)
+
+# Watched sources: comma-separated YouTube channel ids (UC...) and playlist ids (PL...)
+CHANNELS = [c.strip() for c in os.getenv("MCP_PREFETCH_CHANNELS", "").split(",") if c.strip()]
+PLAYLISTS = [p.strip() for p in os.getenv("MCP_PREFETCH_PLAYLISTS", "").split(",") if p.strip()]
+INTERVAL_SECONDS = float(os.getenv("MCP_PREFETCH_INTERVAL", "1800"))
+# Drafts are only generated inside the off-peak window (local hours "start-end",
+# may wrap midnight) and while today's LLM budget lasts. The budget counts
+# transcript characters sent for drafting; 0 disables drafts.
+OFFPEAK_HOURS = os.getenv("MCP_PREFETCH_OFFPEAK", "1-6")
+LLM_BUDGET_CHARS = int(os.getenv("MCP_PREFETCH_LLM_BUDGET", "0"))
+DRAFT_TONE = os.getenv("MCP_PREFETCH_TONE", "educational")
+MAX_ATTEMPTS = 3  # new uploads often have no captions yet; retry on the next polls
+MAX_PENDING_DRAFTS = 100  # oldest waiting videos are dropped beyond this
+
+FEED_URL = "https://www.youtube.com/feeds/videos.xml?{kind}_id={source_id}"
+FEED_NS = {"atom": "http://www.w3.org/2005/Atom", "yt": "http://www.youtube.com/xml/schemas/2015"}
+LEASE = "prefetch"
+
+_owner = f"{socket.gethostname()}:{os.getpid()}"
+_stop = threading.Event()
+STATUS = {"enabled": False, "leader": False, "last_poll": None, "fetched": 0, "drafted": 0}
+
+
+def feed_video_ids(kind: str, source_id: str) -> list:
+    """Video ids in a channel or playlist RSS feed (YouTube lists the latest 15), newest first."""
+    url = FEED_URL.format(kind=kind, source_id=source_id)
+    with urllib.request.urlopen(url, timeout=20) as response:
+        root = ET.fromstring(response.read())
+    return [entry.findtext("yt:videoId", namespaces=FEED_NS) for entry in root.findall("atom:entry", FEED_NS)]
+
+
+def in_offpeak(now: datetime = None) -> bool:
+    if not OFFPEAK_HOURS:
+        return False
+    start, _, end = OFFPEAK_HOURS.partition("-")
+    hour = (now or datetime.now()).hour
+    start, end = int(start), int(end or start)
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+def _budget_left() -> int:
+    spent = get_cache().get("prefetch", f"spent:{datetime.now():%Y-%m-%d}", 0)
+    return LLM_BUDGET_CHARS - spent
+
+
+def _spend(chars: int):
+    key = f"spent:{datetime.now():%Y-%m-%d}"
+    get_cache().set("prefetch", key, get_cache().get("prefetch", key, 0) + chars, ttl=2 * 86400)
+
+
+def _renew() -> bool:
+    STATUS["leader"] = get_cache().acquire_lease(LEASE, _owner, ttl=INTERVAL_SECONDS * 2 + 60)
+    return STATUS["leader"]
+
+
+def _fetch_new(sources: list):
+    """Fetch transcripts of videos not seen before; returns the ids that are ready for a draft."""
+    from agents.transcript_agent import get_transcript
+
+    cache = get_cache()
+    pending = deque(cache.get("prefetch", "pending_drafts", []), maxlen=MAX_PENDING_DRAFTS)
+    for kind, source_id in sources:
+        try:
+            video_ids = feed_video_ids(kind, source_id)
+        except Exception as e:
+            logger.warning(f"Prefetch: could not read {kind} feed {source_id}: {e}")
+            continue
+        for video_id in video_ids:
+            if _stop.is_set() or not _renew():
+                cache.set("prefetch", "pending_drafts", list(pending))
+                return pending
+            state = cache.get("prefetch", f"video:{video_id}", {"attempts": 0})
+            if state.get("fetched_at") or state["attempts"] >= MAX_ATTEMPTS:
+                continue
+            state["source"] = f"{kind}:{source_id}"
+            state["attempts"] += 1
+            try:
+                result = get_transcript(video_id)
+                state.update(fetched_at=time.time(), chars=len(result["clean_transcript"]), error=None)
+                if LLM_BUDGET_CHARS > 0:
+                    pending.append(video_id)
+                STATUS["fetched"] += 1
+                logger.info(f"Prefetch: transcript for {video_id} ready ({state['chars']} chars)")
+            except Exception as e:
+                state["error"] = str(e)
+                logger.warning(f"Prefetch: transcript for {video_id} failed (attempt {state['attempts']}): {e}")
+            cache.set("prefetch", f"video:{video_id}", state)
+    cache.set("prefetch", "pending_drafts", list(pending))
+    return pending
+
+
+def _draft_pending(pending: deque):
+    """Pre-generate blog drafts (cached by BlogAgent) while off-peak and within budget."""
+    from agents.blog_agent import generate_blog
+    from segments import load_segments
+
+    cache = get_cache()
+    while pending and in_offpeak() and not _stop.is_set() and _renew():
+        video_id = pending[0]
+        segments = load_segments(video_id)
+        if segments is None:
+            pending.popleft()
+            continue
+        if len(segments.text) > _budget_left():
+            logger.info(f"Prefetch: LLM budget left for today does not cover {video_id} ({len(segments.text)} chars)")
+            break
+        pending.popleft()
+        _spend(len(segments.text))
+        try:
+            generate_blog(segments.text, tone=DRAFT_TONE, video_id=video_id)
+            state = cache.get("prefetch", f"video:{video_id}", {})
+            state["drafted_at"] = time.time()
+            cache.set("prefetch", f"video:{video_id}", state)
+            STATUS["drafted"] += 1
+        except Exception as e:
+            logger.warning(f"Prefetch: draft for {video_id} failed: {e}")
+        cache.set("prefetch", "pending_drafts", list(pending))
+
+
+def run_once():
+    """One poll: fetch transcripts of new videos, then draft if the window and budget allow."""
+    if not _renew():
+        return
+    start = datetime.now()
+    sources = [("channel", c) for c in CHANNELS] + [("playlist", p) for p in PLAYLISTS]
+    pending = _fetch_new(sources)
+    if pending and LLM_BUDGET_CHARS > 0:
+        _draft_pending(pending)
+    STATUS["last_poll"] = datetime.now().isoformat(timespec="seconds")
+    elapsed = (datetime.now() - start).total_seconds()
+    logger.info(f"Prefetch poll finished in {elapsed:.2f}s, {len(pending)} drafts pending")
+
+
+def _loop():
+    _stop.wait(5)  # let the worker finish starting up
+    # Every worker runs the loop, but only the lease holder does any work
+    while not _stop.is_set():
+        try:
+            run_once()
+        except Exception as e:
+            logger.error(f"Prefetch poll failed: {e}", exc_info=True)
+        _stop.wait(INTERVAL_SECONDS)
+
+
+def start():
+    """Start the scheduler thread if any channel or playlist is configured."""
+    if not CHANNELS and not PLAYLISTS:
+        return
+    STATUS["enabled"] = True
+    threading.Thread(target=_loop, name="prefetch", daemon=True).start()
+    logger.info(f"Prefetch scheduler watching {len(CHANNELS)} channels and {len(PLAYLISTS)} playlists every {INTERVAL_SECONDS:.0f}s")
+
+
+def stop():
+    _stop.set()
@@ -0,0 +1,125 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+import wire
+from storage import atomic_output, output_url, unique_stem
+
+# Per-request profiling is a debugging aid: off unless the deployment opts in
+ENABLED = os.getenv("MCP_PROFILING", "0") == "1"
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 15
+TRACEMALLOC_FRAMES = 5
+
+# Where time goes, by the module (or C function) it is spent in
+CATEGORIES = [
+    ("network", ("_ssl.", "_socket.", "select.", "selectors.py", "/ssl.py", "/socket.py", "httpx", "httpcore", "urllib3", "requests/")),
+    ("llm_client", ("/openai/",)),
+    ("youtube", ("youtube_transcript_api",)),
+    ("docx", ("/docx/", "lxml")),
+    ("reportlab", ("reportlab",)),
+    ("json", ("/json/", "_json.")),
+    ("sqlite", ("sqlite3",)),
+    ("compression", ("zlib.", "gzip.py", "zstandard")),
+    ("waiting_on_threads", ("threading.py", "concurrent/futures", "lock' objects")),
+    ("agents", ("/agents/",)),
+]
+
+# One capture at a time per process: from Python 3.12 cProfile hooks into the
+# interpreter-wide sys.monitoring, which takes a single profiler, and
+# tracemalloc's peak and snapshots are process-wide anyway
+_capture_lock = threading.Lock()
+
+
+def _category(filename: str, function: str) -> str:
+    location = f"{filename}:{function}"
+    for name, markers in CATEGORIES:
+        if any(marker in location for marker in markers):
+            return name
+    return "other"
+
+
+class CallProfile:
+    """
+    cProfile + tracemalloc capture of one tool call, requested with ``"profile": true``.
+
+    cProfile only sees the thread that runs the tool; work the tool hands to
+    other threads or processes (parallel sections, diagram rendering) shows up
+    as waiting_on_threads. tracemalloc is process-wide, so allocations by
+    concurrent requests are included in the allocation figures. Only one call
+    per process is profiled at a time; a call that asks while another one is
+    being profiled runs normally and ``captured`` stays False.
+    """
+
+    def __init__(self, request_id: str, tool: str):
+        self.request_id = request_id
+        self.tool = tool
+        self.profiler = cProfile.Profile()
+        self.wall_seconds = None
+        self.allocations = []
+        self.peak_bytes = None
+        self.captured = False
+
+    def run(self, func, inputs: dict):
+        if not _capture_lock.acquire(blocking=False):
+            return func(**inputs)
+        self.captured = True
+        try:
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+            start = time.perf_counter()
+            try:
+                return self.profiler.runcall(func, **inputs)
+            finally:
+                self.wall_seconds = time.perf_counter() - start
+                after = tracemalloc.take_snapshot()
+                self.peak_bytes = tracemalloc.get_traced_memory()[1]
+                self.allocations = [
+                    {"where": str(stat.traceback[0]), "size_diff_bytes": stat.size_diff, "count_diff": stat.count_diff}
+                    for stat in after.compare_to(before, "lineno")[:TOP_ALLOCATIONS]
+                ]
+                if started:
+                    tracemalloc.stop()
+        finally:
+            _capture_lock.release()
+
+    def report(self, result) -> dict:
+        """Write the report next to the outputs and return the summary that goes into the response."""
+        encode_start = time.perf_counter()
+        response_bytes = len(wire.dumps(result))
+        encode_seconds = time.perf_counter() - encode_start
+
+        stats = pstats.Stats(self.profiler)
+        by_category = {}
+        for (filename, _, function), (_, _, tottime, _, _) in stats.stats.items():
+            category = _category(filename, function)
+            by_category[category] = by_category.get(category, 0.0) + tottime
+        text = io.StringIO()
+        pstats.Stats(self.profiler, stream=text).sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+
+        summary = {
+            "tool": self.tool,
+            "request_id": self.request_id,
+            "wall_seconds": round(self.wall_seconds, 4),
+            "seconds_by_category": {k: round(v, 4) for k, v in sorted(by_category.items(), key=lambda kv: -kv[1])},
+            "response_encode_seconds": round(encode_seconds, 4),
+            "response_bytes": response_bytes,
+            "peak_traced_bytes": self.peak_bytes,
+            "top_allocations": self.allocations
+        }
+        # request_id comes from the client, so it never becomes part of a path
+        stem = f"profiles/{unique_stem('profile')}"
+        with atomic_output(f"{stem}.prof") as path:
+            self.profiler.dump_stats(path)
+        with atomic_output(f"{stem}.json") as path:
+            with open(path, "w") as f:
+                json.dump(dict(summary, top_functions=text.getvalue()), f, indent=2)
+        return dict(summary, report_url=output_url(f"{stem}.json"), stats_url=output_url(f"{stem}.prof"))
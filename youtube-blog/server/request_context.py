@@ -0,0 +1,124 @@
+import contextvars
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RequestCancelled(Exception):
+    """Raised inside a tool when its JSON-RPC request was cancelled."""
+
+
+class DeadlineExceeded(RequestCancelled):
+    """Raised inside a tool when its request's time budget is used up."""
+
+
+class RequestContext:
+    """
+    Per-request state that agents can consult while a tool call runs.
+
+    The JSON-RPC handler creates one per call_tool request and cancels it when
+    the caller disconnects or sends a "cancel" request. Agents call
+    check_cancelled() between expensive steps and register_abort() to have
+    in-flight I/O (e.g. a streaming LLM response) closed on cancellation.
+    ``deadline`` is a time.monotonic() value; remaining() tells agents how much
+    of the caller's budget is left so they can size or refuse work.
+    """
+
+    def __init__(self, request_id: str, deadline: float = None):
+        self.request_id = request_id
+        self.deadline = deadline
+        self.reason = None
+        self.deadline_exceeded = False
+        self._cancelled = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self, reason: str = "cancelled by client"):
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self.reason = reason
+            self._cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+        logger.info(f"Request {self.request_id} cancelled: {reason}")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Abort callback for {self.request_id} failed: {e}")
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline (infinite when the caller set none)."""
+        if self.deadline is None:
+            return float("inf")
+        return self.deadline - time.monotonic()
+
+    def expire(self):
+        self.deadline_exceeded = True
+        self.cancel("deadline exceeded")
+
+    def check(self):
+        if not self._cancelled.is_set() and self.remaining() <= 0:
+            self.expire()
+        if self._cancelled.is_set():
+            error = DeadlineExceeded if self.deadline_exceeded else RequestCancelled
+            raise error(f"Request {self.request_id} {self.reason}")
+
+    def register_abort(self, callback):
+        """Run callback on cancellation (immediately if already cancelled). Returns an unregister function."""
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._discard(callback)
+        callback()
+        return lambda: None
+
+    def _discard(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+_current = contextvars.ContextVar("request_context", default=None)
+
+
+def current_context():
+    """The RequestContext of the tool call running in this thread, or None outside the server."""
+    return _current.get()
+
+
+def set_context(ctx: RequestContext):
+    return _current.set(ctx)
+
+
+def reset_context(token):
+    """Undo set_context() with the token it returned, so a pooled thread does not keep the request."""
+    _current.reset(token)
+
+
+def check_cancelled():
+    ctx = _current.get()
+    if ctx is not None:
+        ctx.check()
+
+
+def remaining_budget(default: float = float("inf")) -> float:
+    """Seconds the current request may still use; ``default`` outside a request or without a deadline."""
+    ctx = _current.get()
+    if ctx is None or ctx.deadline is None:
+        return default
+    return ctx.remaining()
+
+
+def require_budget(seconds: float, what: str):
+    """Refuse work up front when the remaining budget cannot cover its minimum duration."""
+    check_cancelled()
+    left = remaining_budget()
+    if left < seconds:
+        raise DeadlineExceeded(f"Not enough time left for {what}: {left:.1f}s remaining, needs at least {seconds:.0f}s")
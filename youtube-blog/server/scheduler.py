@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# Per worker: tool calls running at once, how many batch calls may hold a slot
+# (the rest stay free for interactive users), and how many may wait in line
+TOOL_CONCURRENCY = int(os.getenv("MCP_TOOL_CONCURRENCY", "8"))
+BATCH_MAX_SLOTS = int(os.getenv("MCP_BATCH_MAX_SLOTS", str(max(TOOL_CONCURRENCY // 2, 1))))
+MAX_QUEUE_DEPTH = int(os.getenv("MCP_MAX_QUEUE_DEPTH", "64"))
+PRIORITIES = ("interactive", "batch")  # highest first
+
+
+class SchedulerBusy(Exception):
+    """Raised when the queue is full; ``retry_after`` is a hint in seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Server busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class FairScheduler:
+    """
+    Admission control in front of tool dispatch.
+
+    Interactive calls always go before batch calls, and batch calls never hold
+    more than BATCH_MAX_SLOTS slots. Within a class, clients are served round
+    robin, one call each, so a client with 200 queued calls does not delay a
+    client with one. Beyond MAX_QUEUE_DEPTH waiting calls, new calls are
+    refused at once with a retry-after hint instead of queueing.
+    """
+
+    def __init__(self, slots: int = TOOL_CONCURRENCY, batch_slots: int = BATCH_MAX_SLOTS, max_depth: int = MAX_QUEUE_DEPTH):
+        self.slots = slots
+        self.batch_slots = batch_slots
+        self.max_depth = max_depth
+        self.running = {priority: 0 for priority in PRIORITIES}
+        # priority -> client_id -> deque of waiting futures, clients in round-robin order
+        self.queues = {priority: OrderedDict() for priority in PRIORITIES}
+        self.waiting = 0
+        self.rejected = 0
+        self.average_seconds = 30.0  # moving average of tool call duration, for retry-after
+
+    def _can_run(self, priority: str) -> bool:
+        if sum(self.running.values()) >= self.slots:
+            return False
+        return priority != "batch" or self.running["batch"] < self.batch_slots
+
+    def _has_waiters(self, priority: str) -> bool:
+        # Waiting calls of this class or a higher one go first
+        for level in PRIORITIES[:PRIORITIES.index(priority) + 1]:
+            if self.queues[level]:
+                return True
+        return False
+
+    def retry_after(self) -> int:
+        estimate = self.average_seconds * (self.waiting + 1) / max(self.slots, 1)
+        return int(min(max(estimate, 1), 60))
+
+    async def acquire(self, client_id: str, priority: str = "interactive", timeout: float = None):
+        """
+        Wait for a slot. Raises SchedulerBusy when the queue is full, asyncio.TimeoutError after ``timeout``.
+
+        Cancelling the waiting task takes the call out of its client's queue.
+        """
+        if priority not in PRIORITIES:
+            priority = "interactive"
+        if self._can_run(priority) and not self._has_waiters(priority):
+            self.running[priority] += 1
+            return
+        if self.waiting >= self.max_depth:
+            self.rejected += 1
+            raise SchedulerBusy(self.retry_after())
+        waiter = asyncio.get_running_loop().create_future()
+        self.queues[priority].setdefault(client_id, deque()).append(waiter)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                self.release(priority)  # granted just as we gave up
+            else:
+                waiter.cancel()
+                self._remove(priority, client_id, waiter)
+            raise
+
+    def _remove(self, priority: str, client_id: str, waiter):
+        queue = self.queues[priority].get(client_id)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self.waiting -= 1
+            if not queue:
+                del self.queues[priority][client_id]
+
+    def release(self, priority: str = "interactive", seconds: float = None):
+        if priority not in PRIORITIES:
+            priority = "interactive"
+        self.running[priority] -= 1
+        if seconds is not None:
+            self.average_seconds = 0.8 * self.average_seconds + 0.2 * seconds
+        self._grant()
+
+    def _grant(self):
+        for priority in PRIORITIES:
+            clients = self.queues[priority]
+            while clients and self._can_run(priority):
+                client_id, queue = next(iter(clients.items()))
+                waiter = queue.popleft()
+                self.waiting -= 1
+                # Round robin: the client goes to the back of the line
+                del clients[client_id]
+                if queue:
+                    clients[client_id] = queue
+                if not waiter.cancelled():
+                    self.running[priority] += 1
+                    waiter.set_result(None)
+            if clients:
+                return  # lower classes wait while a higher one is queued
+
+    def stats(self) -> dict:
+        return {
+            "running": dict(self.running),
+            "waiting": {priority: sum(len(q) for q in clients.values()) for priority, clients in self.queues.items()},
+            "clients_waiting": {priority: len(clients) for priority, clients in self.queues.items()},
+            "rejected": self.rejected,
+            "slots": self.slots,
+            "max_queue_depth": self.max_depth
+        }
@@ -0,0 +1,144 @@
+REFERENCE_PREFIX = "$prev."
+
+TYPES = {
+    "string": str,
+    "boolean": bool,
+    "integer": int,
+    "number": (int, float),
+    "array": list,
+    "object": dict
+}
+
+
+class Reference:
+    """A ``$prev.key`` input in a plan: only the type from the producing tool's outputSchema is known."""
+
+    __slots__ = ("key", "type")
+
+    def __init__(self, key: str, type_: str = None):
+        self.key = key
+        self.type = type_
+
+
+def _type_matches(value, type_: str) -> bool:
+    if isinstance(value, Reference):
+        return value.type is None or value.type == type_ or (type_ == "number" and value.type == "integer")
+    if isinstance(value, bool) and type_ in ("integer", "number"):
+        return False
+    return isinstance(value, TYPES[type_])
+
+
+def compile_schema(schema: dict):
+    """
+    Compile the JSON-schema subset the manifests use into a validator.
+
+    Supports ``type``, ``enum``, ``properties``, ``required``, ``items`` and
+    ``additionalProperties`` (default false: tools are called as ``func(**inputs)``,
+    so an unknown key would fail anyway). The returned ``validate(value, path)``
+    gives a list of error messages, empty when the value is valid. All schema
+    walking happens here, once; validation only runs the prepared checks.
+    """
+    checks = []
+    type_ = schema.get("type")
+    if type_ is not None:
+        def check_type(value, path):
+            if not _type_matches(value, type_):
+                kind = f"$prev.{value.key} ({value.type})" if isinstance(value, Reference) else type(value).__name__
+                return [f"{path}: expected {type_}, got {kind}"]
+            return []
+        checks.append(check_type)
+
+    if "enum" in schema:
+        allowed = list(schema["enum"])
+
+        def check_enum(value, path):
+            if not isinstance(value, Reference) and value not in allowed:
+                return [f"{path}: {value!r} is not one of {allowed}"]
+            return []
+        checks.append(check_enum)
+
+    if type_ == "object" or "properties" in schema:
+        properties = {name: compile_schema(sub) for name, sub in schema.get("properties", {}).items()}
+        required = list(schema.get("required", []))
+        additional = schema.get("additionalProperties", False)
+
+        def check_object(value, path):
+            if not isinstance(value, dict):
+                return []
+            errors = [f"{path}.{name}: required input is missing" for name in required if name not in value]
+            for name, item in value.items():
+                validate = properties.get(name)
+                if validate is not None:
+                    errors += validate(item, f"{path}.{name}")
+                elif not additional:
+                    errors.append(f"{path}.{name}: unexpected input")
+            return errors
+        checks.append(check_object)
+
+    if "items" in schema:
+        validate_item = compile_schema(schema["items"])
+
+        def check_items(value, path):
+            if not isinstance(value, list):
+                return []
+            return [error for i, item in enumerate(value) for error in validate_item(item, f"{path}[{i}]")]
+        checks.append(check_items)
+
+    def check_reference(value, path):
+        if isinstance(value, str) and value.startswith(REFERENCE_PREFIX):
+            return [f"{path}: unresolved reference {value!r}"]
+        return []
+    checks.append(check_reference)
+
+    if len(checks) == 1:
+        return checks[0]
+
+    def validate(value, path="inputs"):
+        errors = []
+        for check in checks:
+            errors += check(value, path)
+        return errors
+    return validate
+
+
+class ToolSchema:
+    """Compiled input validator and declared output types of one tool manifest."""
+
+    def __init__(self, manifest: dict):
+        self.name = manifest["name"]
+        self.validate = compile_schema(manifest.get("inputSchema", {"type": "object"}))
+        outputs = manifest.get("outputSchema", {}).get("properties", {})
+        self.outputs = {key: spec.get("type") for key, spec in outputs.items()}
+
+
+def validate_plan(steps: list, schemas: dict) -> list:
+    """
+    Check a whole plan before anything runs.
+
+    Literal inputs are validated against each tool's inputSchema; ``$prev.key``
+    inputs must name an output that an earlier step declares, with a matching
+    type. Returns a list of error messages (empty for a valid plan).
+    """
+    errors = []
+    available = {}
+    for i, step in enumerate(steps, 1):
+        tool = step.get("tool") if isinstance(step, dict) else None
+        schema = schemas.get(tool)
+        if schema is None:
+            errors.append(f"step {i}: unknown tool {tool!r}")
+            continue
+        inputs = step.get("inputs", {})
+        if not isinstance(inputs, dict):
+            errors.append(f"step {i} ({tool}): inputs must be an object")
+            continue
+        resolved = {}
+        for name, value in inputs.items():
+            if isinstance(value, str) and value.startswith(REFERENCE_PREFIX):
+                key = value[len(REFERENCE_PREFIX):]
+                if key not in available:
+                    errors.append(f"step {i} ({tool}): inputs.{name} refers to {value}, which no earlier step returns")
+                value = Reference(key, available.get(key))
+            resolved[name] = value
+        errors += [f"step {i} ({tool}): {error}" for error in schema.validate(resolved, "inputs")]
+        available.update(schema.outputs)
+    return errors
@@ -0,0 +1,121 @@
+import math
+import re
+from collections import Counter
+
+from segments import TranscriptSegments
+
+STOPWORDS = set("""
+about after again also because been before being between both but could does doing down during each
+from further have having here into just like more most much other over really right same should some
+such than that their them then there these they this those through under very want well were what
+when where which while will with would your you're it's that's going know think thing things yeah okay
+""".split())
+
+CHAPTER_LINE = re.compile(r"^\s*(?:(\d{1,2}):)?(\d{1,2}):(\d{2})\s*[-–—:]?\s*(.+?)\s*$")
+
+
+def parse_chapters(chapters) -> list:
+    """
+    Parse YouTube chapter markers into [{"start": seconds, "title": str}, ...].
+
+    Accepts the text users copy from a video description ("00:00 Intro",
+    "1:02:10 - Q&A", one per line) or an already structured list.
+    """
+    if not chapters:
+        return []
+    if isinstance(chapters, list):
+        parsed = [{"start": float(c["start"]), "title": str(c.get("title", ""))} for c in chapters]
+    else:
+        parsed = []
+        for line in str(chapters).splitlines():
+            match = CHAPTER_LINE.match(line)
+            if match:
+                hours, minutes, seconds, title = match.groups()
+                start = int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)
+                parsed.append({"start": float(start), "title": title})
+    return sorted(parsed, key=lambda c: c["start"])
+
+
+def sentence_segments(text: str) -> TranscriptSegments:
+    """Untimed segments (one per sentence) for transcripts that did not come from the segment store."""
+    sentences = [s for s in re.split(r"(?<=[.!?])\s+", text) if s]
+    return TranscriptSegments.from_raw({"text": s, "start": 0.0, "duration": 0.0} for s in sentences)
+
+
+def _terms(text: str) -> Counter:
+    return Counter(w for w in re.findall(r"[a-z']{4,}", text.lower()) if w not in STOPWORDS)
+
+
+def _dissimilarity(left: Counter, right: Counter) -> float:
+    dot = sum(count * right[word] for word, count in left.items() if word in right)
+    norm = math.sqrt(sum(c * c for c in left.values())) * math.sqrt(sum(c * c for c in right.values()))
+    return 1.0 - (dot / norm if norm else 0.0)
+
+
+def _topic_boundaries(segments: TranscriptSegments, count: int) -> list:
+    """
+    Pick count - 1 segment indices where the vocabulary shifts the most.
+
+    Each boundary is searched only near its evenly spaced ideal position, so the
+    sections stay balanced (latency is bounded by the longest one) while still
+    snapping to a topic change.
+    """
+    total = len(segments.text)
+    window_chars = max(total // (count * 4), 400)
+    boundaries = []
+    for k in range(1, count):
+        ideal = total * k // count
+        low = segments.index_at_offset(max(ideal - total // (count * 2), 0))
+        high = segments.index_at_offset(min(ideal + total // (count * 2), total - 1))
+        if boundaries:
+            # Keep every section at least half the nominal size
+            low = max(low, segments.index_at_offset(segments.offsets[boundaries[-1]] + total // (count * 2)))
+        step = max((high - low) // 40, 1)
+        best, best_score = segments.index_at_offset(ideal), -1.0
+        for i in range(low + 1, high, step):
+            offset = segments.offsets[i]
+            left = _terms(segments.text[max(offset - window_chars, 0):offset])
+            right = _terms(segments.text[offset:offset + window_chars])
+            # Slight preference for the ideal position breaks ties between flat regions
+            score = _dissimilarity(left, right) - 0.05 * abs(offset - ideal) / max(window_chars, 1)
+            if score > best_score:
+                best, best_score = i, score
+        if boundaries and best <= boundaries[-1]:
+            continue
+        boundaries.append(best)
+    return [b for b in boundaries if 0 < b < len(segments)]
+
+
+def detect_sections(segments: TranscriptSegments, section_chars: int, max_sections: int = 12, chapters=None) -> list:
+    """
+    Split a transcript into ordered sections for parallel generation.
+
+    Chapter markers win when given (and the segments carry timings); otherwise
+    boundaries are placed at topic shifts. Returns dicts with ``title`` (chapter
+    title or None), ``start`` (seconds, or None when untimed) and ``text``.
+    """
+    if len(segments) == 0:
+        return []
+    timed = segments.duration > 0
+    chapters = parse_chapters(chapters) if timed else []
+
+    if len(chapters) >= 2:
+        starts = [segments.index_at_time(c["start"]) for c in chapters]
+        starts[0] = 0  # anything before the first marker belongs to it
+        titles = [c["title"] for c in chapters]
+    else:
+        count = min(max(math.ceil(len(segments.text) / section_chars), 1), max_sections, len(segments))
+        starts = [0] + _topic_boundaries(segments, count)
+        titles = [None] * len(starts)
+
+    sections = []
+    for i, first in enumerate(starts):
+        stop = starts[i + 1] if i + 1 < len(starts) else len(segments)
+        if stop <= first:
+            continue
+        sections.append({
+            "title": titles[i],
+            "start": segments.starts[first] if timed else None,
+            "text": segments.text_range(first, stop)
+        })
+    return sections
@@ -0,0 +1,138 @@
+import os
+import struct
+import zlib
+from array import array
+from bisect import bisect_right
+
+from storage import atomic_output, output_path, output_url
+
+MAGIC = b"YTS1"
+HEADER = struct.Struct("<4sII")  # magic, segment count, compressed text length
+
+
+class TranscriptSegments:
+    """
+    Timestamp-preserving transcript stored as one text buffer plus parallel arrays.
+
+    Segment ``i`` is ``text[offsets[i]:offsets[i + 1]]`` (without the joining
+    space) and starts at ``starts[i]`` seconds for ``durations[i]`` seconds.
+    Both arrays are sorted, so lookups by time or by character offset are a
+    binary search. ``text`` is exactly the ``clean_transcript`` string the
+    TranscriptAgent has always returned.
+    """
+
+    __slots__ = ("text", "offsets", "starts", "durations")
+
+    def __init__(self, text: str, offsets: array, starts: array, durations: array):
+        self.text = text
+        self.offsets = offsets
+        self.starts = starts
+        self.durations = durations
+
+    @classmethod
+    def from_raw(cls, raw_segments) -> "TranscriptSegments":
+        """Build from youtube_transcript_api raw data: dicts with text/start/duration."""
+        offsets, starts, durations = array("I"), array("f"), array("f")
+        parts = []
+        position = 0
+        for segment in raw_segments:
+            text = segment["text"]
+            offsets.append(position)
+            starts.append(segment.get("start", 0.0))
+            durations.append(segment.get("duration", 0.0))
+            parts.append(text)
+            position += len(text) + 1
+        offsets.append(max(position - 1, 0))
+        return cls(" ".join(parts), offsets, starts, durations)
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def duration(self) -> float:
+        if not self.starts:
+            return 0.0
+        return self.starts[-1] + self.durations[-1]
+
+    def segment(self, i: int) -> dict:
+        end = self.offsets[i + 1] - (1 if i + 1 < len(self) else 0)
+        return {"text": self.text[self.offsets[i]:end], "start": self.starts[i], "duration": self.durations[i]}
+
+    def index_at_time(self, seconds: float) -> int:
+        """Index of the segment playing at ``seconds`` (clamped to the first/last segment)."""
+        return min(max(bisect_right(self.starts, seconds) - 1, 0), len(self) - 1)
+
+    def index_at_offset(self, offset: int) -> int:
+        """Index of the segment containing character ``offset`` of ``text``."""
+        return min(max(bisect_right(self.offsets, offset) - 1, 0), len(self) - 1)
+
+    def time_at_offset(self, offset: int) -> float:
+        return self.starts[self.index_at_offset(offset)]
+
+    def text_between(self, start_seconds: float, end_seconds: float) -> str:
+        """Text of every segment overlapping [start_seconds, end_seconds)."""
+        first = self.index_at_time(start_seconds)
+        last = max(bisect_right(self.starts, end_seconds - 1e-6) - 1, first)
+        return self.text_range(first, last + 1)
+
+    def text_range(self, first: int, stop: int) -> str:
+        """Joined text of segments ``first`` .. ``stop - 1``."""
+        return self.text[self.offsets[first]:self.offsets[stop]].rstrip()
+
+    def chunks(self, max_chars: int):
+        """Split into consecutive (first, stop) segment ranges of at most ~max_chars characters."""
+        ranges, first = [], 0
+        while first < len(self):
+            stop = bisect_right(self.offsets, self.offsets[first] + max_chars, lo=first + 1) - 1
+            stop = min(max(stop, first + 1), len(self))
+            ranges.append((first, stop))
+            first = stop
+        return ranges
+
+    def to_bytes(self) -> bytes:
+        text = zlib.compress(self.text.encode("utf-8"), 6)
+        return b"".join([
+            HEADER.pack(MAGIC, len(self), len(text)),
+            self.offsets.tobytes(), self.starts.tobytes(), self.durations.tobytes(),
+            text
+        ])
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "TranscriptSegments":
+        magic, count, text_len = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a transcript segment file")
+        position = HEADER.size
+        arrays = []
+        for typecode, length in (("I", count + 1), ("f", count), ("f", count)):
+            arr = array(typecode)
+            size = arr.itemsize * length
+            arr.frombytes(data[position:position + size])
+            arrays.append(arr)
+            position += size
+        text = zlib.decompress(data[position:position + text_len]).decode("utf-8")
+        return cls(text, *arrays)
+
+
+def segments_filename(video_id: str) -> str:
+    return f"transcripts/{video_id}.yts"
+
+
+def segments_url(video_id: str) -> str:
+    return output_url(segments_filename(video_id))
+
+
+def save_segments(video_id: str, segments: TranscriptSegments) -> str:
+    with atomic_output(segments_filename(video_id)) as path:
+        with open(path, "wb") as f:
+            f.write(segments.to_bytes())
+    return segments_url(video_id)
+
+
+def load_segments(video_id: str):
+    """Return the stored segments for a video, or None if it was never fetched."""
+    path = output_path(segments_filename(video_id))
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return TranscriptSegments.from_bytes(f.read())
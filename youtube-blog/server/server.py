@@ -1,18 +1,38 @@
-from fastapi import FastAPI, Request
-from agents.transcript_agent import get_transcript
-from agents.blog_agent import generate_blog
-from agents.visual_agent import generate_diagram
-from agents.exporter_agent import export_blog
+import time
+_PROCESS_START = time.perf_counter()
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
+from storage import LOG_DIR, OUTPUTS_DIR
+from cache import get_cache
+import prefetch
+import bulk_export
+import wire
+import profiling
+from library import get_library
+from scheduler import FairScheduler, SchedulerBusy
+from schema import ToolSchema, validate_plan
+from request_context import RequestContext, RequestCancelled, DeadlineExceeded, reset_context, set_context
+import asyncio
 import json, os
+import math
+import uuid
+import importlib
+import threading
 import logging
+import logging.handlers
 from datetime import datetime
 
 # Configure logging
+# Every worker appends to the same file; WatchedFileHandler reopens it after
+# external rotation and the pid in the format tells the workers apart.
+os.makedirs(LOG_DIR, exist_ok=True)
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    format='%(asctime)s - [%(process)d] %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler('server.log'),
+        logging.handlers.WatchedFileHandler(os.path.join(LOG_DIR, 'server.log')),
         logging.StreamHandler()
     ]
 )
@@ -24,13 +44,71 @@ app = FastAPI(title="YouTube Blog MCP Server")
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MANIFESTS_DIR = os.path.join(BASE_DIR, "manifests")
 
+# Agent modules pull in openai, youtube_transcript_api, python-docx and reportlab,
+# so they are imported on first call (or by the background pre-warm) instead of
+# at startup. That keeps cold start short for processes that only serve /tools.
 TOOLS = {
-    "TranscriptAgent.get_transcript": get_transcript,
-    "BlogAgent.generate_blog": generate_blog,
-    "VisualAgent.generate_diagram": generate_diagram,
-    "ExporterAgent.export_blog": export_blog
+    "TranscriptAgent.get_transcript": ("agents.transcript_agent", "get_transcript"),
+    "BlogAgent.generate_blog": ("agents.blog_agent", "generate_blog"),
+    "VisualAgent.generate_diagram": ("agents.visual_agent", "generate_diagram"),
+    "ExporterAgent.export_blog": ("agents.exporter_agent", "export_blog")
 }
 
+_loaded_tools = {}
+_load_lock = threading.Lock()
+IMPORT_REPORT = {"startup_seconds": None, "modules": {}}
+
+def load_tool(name):
+    """Resolve a tool name to its function, importing the agent module on first use."""
+    func = _loaded_tools.get(name)
+    if func is not None:
+        return func
+    target = TOOLS.get(name)
+    if target is None:
+        return None
+    module_name, attr = target
+    with _load_lock:
+        if name not in _loaded_tools:
+            start = time.perf_counter()
+            module = importlib.import_module(module_name)
+            elapsed = time.perf_counter() - start
+            IMPORT_REPORT["modules"].setdefault(module_name, round(elapsed, 4))
+            logger.info(f"Loaded {module_name} for {name} in {elapsed:.3f}s")
+            _loaded_tools[name] = getattr(module, attr)
+    return _loaded_tools[name]
+
+def _prewarm_tools():
+    for name in TOOLS:
+        try:
+            load_tool(name)
+        except Exception as e:
+            logger.error(f"Pre-warming {name} failed: {e}", exc_info=True)
+    logger.info(f"Pre-warm finished. Import report: {IMPORT_REPORT}")
+
+@app.on_event("startup")
+def report_startup():
+    IMPORT_REPORT["startup_seconds"] = round(time.perf_counter() - _PROCESS_START, 4)
+    logger.info(f"Server ready in {IMPORT_REPORT['startup_seconds']:.3f}s (agents not loaded yet)")
+    tool_schemas()
+    # Import the agents off the request path once the server is up; MCP_PREWARM=0 keeps them fully lazy
+    if os.getenv("MCP_PREWARM", "1") != "0":
+        threading.Thread(target=_prewarm_tools, name="tool-prewarm", daemon=True).start()
+    prefetch.start()
+
+@app.on_event("shutdown")
+def stop_background_jobs():
+    prefetch.stop()
+
+@app.get("/health")
+def health():
+    return {
+        "status": "ok",
+        "loaded_tools": sorted(_loaded_tools),
+        "import_report": IMPORT_REPORT,
+        "prefetch": prefetch.STATUS,
+        "scheduler": _scheduler.stats()
+    }
+
 @app.get("/tools")
 def list_tools():
     manifests = []
@@ -42,9 +120,200 @@ def list_tools():
                 manifests.append(json.load(f))
     return manifests
 
+_schemas = None
+
+def tool_schemas():
+    """Input validators compiled from the manifests, built once per worker."""
+    global _schemas
+    if _schemas is None:
+        _schemas = {manifest["name"]: ToolSchema(manifest) for manifest in list_tools()}
+    return _schemas
+
+# Admission control for call_tool (priority classes, per-client fair queuing, load shedding)
+_scheduler = FairScheduler()
+
+# In-flight call_tool requests of this worker, by client-supplied request_id
+_active_requests = {}
+CANCEL_POLL_INTERVAL = 0.5
+CANCEL_FLAG_TTL = 3600
+# Budget for callers that send no "timeout", and the cap for those that do
+MAX_TOOL_SECONDS = float(os.getenv("MCP_MAX_TOOL_SECONDS", "300"))
+
+def _call_in_context(ctx, func, inputs, profile=None):
+    # Executor threads are reused: the next job must not see this request as current
+    token = set_context(ctx)
+    try:
+        ctx.check()
+        if profile is not None:
+            return profile.run(func, inputs)
+        return func(**inputs)
+    finally:
+        reset_context(token)
+
+async def _run_tool(req, ctx, func, inputs, profile=None):
+    """
+    Run a tool in the thread pool and watch for cancellation while it runs.
+
+    The request is cancelled when the HTTP client disconnects, its deadline
+    passes, or a "cancel" request names it (on this worker or, via the shared
+    cache that _poll_cancel_flags reads, on another one).
+    Cancellation returns immediately; the tool thread stops at its next
+    checkpoint and any registered abort (e.g. an open LLM stream) is closed.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(None, _call_in_context, ctx, func, inputs, profile)
+    while True:
+        done, _ = await asyncio.wait({future}, timeout=CANCEL_POLL_INTERVAL)
+        if done:
+            return future.result()
+        if await _poll_cancel(req, ctx):
+            break
+    # Let the worker thread finish in the background; its result is discarded
+    future.add_done_callback(lambda f: f.exception())
+    ctx.check()
+
+async def _poll_cancel(req, ctx) -> bool:
+    """Cancel ctx if its deadline passed, the client left or a "cancel" names it; True when cancelled."""
+    if ctx.cancelled:
+        return True
+    if ctx.remaining() <= 0:
+        ctx.expire()
+    elif await req.is_disconnected():
+        ctx.cancel("client disconnected")
+    else:
+        _watch_cancel_flags()
+    return ctx.cancelled
+
+_cancel_watcher = None
+
+def _watch_cancel_flags():
+    """Start this worker's cancel-flag poller unless it is already running."""
+    global _cancel_watcher
+    if _cancel_watcher is None or _cancel_watcher.done():
+        _cancel_watcher = asyncio.ensure_future(_poll_cancel_flags())
+
+async def _poll_cancel_flags():
+    # One SQLite read per interval for all of this worker's requests, off the
+    # event loop, instead of one per request on it; stops once none are left
+    loop = asyncio.get_running_loop()
+    while _active_requests:
+        contexts = dict(_active_requests)
+        try:
+            flags = await loop.run_in_executor(None, _read_cancel_flags, list(contexts))
+        except Exception as e:
+            logger.warning(f"Reading cancel flags failed: {e}")
+            flags = {}
+        for request_id, reason in flags.items():
+            contexts[request_id].cancel(reason)
+        await asyncio.sleep(CANCEL_POLL_INTERVAL)
+
+def _read_cancel_flags(request_ids):
+    cache = get_cache()
+    flags = {request_id: cache.get("cancel", request_id) for request_id in request_ids}
+    return {request_id: reason for request_id, reason in flags.items() if reason is not None}
+
+async def _acquire_slot(req, ctx, client_id, priority):
+    """
+    Wait for a scheduler slot while watching for cancellation like _run_tool does.
+
+    A cancelled or expired wait leaves the queue (the scheduler drops the waiter)
+    and raises RequestCancelled / DeadlineExceeded; a full queue raises SchedulerBusy.
+    """
+    waiter = asyncio.ensure_future(_scheduler.acquire(client_id, priority))
+    while True:
+        done, _ = await asyncio.wait({waiter}, timeout=CANCEL_POLL_INTERVAL)
+        if done:
+            return waiter.result()
+        if await _poll_cancel(req, ctx):
+            break
+    waiter.cancel()
+    try:
+        await waiter
+    except asyncio.CancelledError:
+        pass
+    else:
+        _scheduler.release(priority)  # the slot was granted as we gave up
+    ctx.check()
+
+@app.post("/export")
+async def export_archive(req: Request):
+    """
+    Stream many blogs in one response: a ZIP of their DOCX/PDF/markdown, or with
+    "format": "pdf" a single combined PDF (see bulk_export.py).
+
+    The export holds one batch-class scheduler slot while it streams, so it
+    queues behind interactive tool calls, and gets MAX_TOOL_SECONDS to finish.
+    """
+    try:
+        request = await req.json()
+        items, include = bulk_export.parse_request(request)
+    except ValueError as e:
+        return Response(str(e), status_code=400)
+    client_ip = req.client.host if req.client else "unknown"
+    client_id = req.headers.get("x-client-id") or client_ip
+    ctx = RequestContext(f"export-{uuid.uuid4().hex}", deadline=time.monotonic() + MAX_TOOL_SECONDS)
+    try:
+        await _acquire_slot(req, ctx, client_id, "batch")
+    except SchedulerBusy as e:
+        logger.warning(f"Rejecting bulk export from {client_id}: queue full, retry after {e.retry_after}s")
+        return Response(str(e), status_code=503, headers={"Retry-After": str(e.retry_after)})
+    except RequestCancelled as e:
+        logger.warning(f"Bulk export from {client_id} gave up while queued: {ctx.reason}")
+        return Response(str(e), status_code=503)
+    try:
+        stem = f"blogs_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        logger.info(f"Bulk export of {len(items)} blogs for {client_id}, format={request.get('format', 'zip')}")
+        if request.get("format") == "pdf":
+            return _BatchStream(bulk_export.stream_combined_pdf(items, ctx), ctx, media_type="application/pdf",
+                                headers={"Content-Disposition": f'attachment; filename="{stem}.pdf"'})
+        return _BatchStream(bulk_export.stream_zip(items, include, ctx), ctx, media_type="application/zip",
+                            headers={"Content-Disposition": f'attachment; filename="{stem}.zip"'})
+    except Exception:
+        _scheduler.release("batch")
+        raise
+
+class _BatchStream(StreamingResponse):
+    """
+    Streams a blocking chunk generator from the thread pool while holding a batch slot.
+
+    The slot is given back when the response ends, not when the body does: a
+    client that disconnects before the first chunk means the body generator
+    never starts, so its finally block would never run.
+    """
+
+    def __init__(self, chunks, ctx, **kwargs):
+        super().__init__(self._stream(chunks), **kwargs)
+        self.ctx = ctx
+        self.finished = False
+
+    async def _stream(self, chunks):
+        async for chunk in iterate_in_threadpool(chunks):
+            yield chunk
+        self.finished = True
+
+    async def __call__(self, scope, receive, send):
+        start_time = datetime.now()
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if not self.finished:
+                # The client left or the export failed: a render still running stops at its next checkpoint
+                self.ctx.cancel("bulk export stopped")
+            _scheduler.release("batch", (datetime.now() - start_time).total_seconds())
+
 @app.post("/jsonrpc")
 async def jsonrpc(req: Request):
-    payload = await req.json()
+    # JSON by default; msgpack and gzip/zstd bodies are negotiated through the
+    # usual Content-Type / Content-Encoding and Accept / Accept-Encoding headers
+    try:
+        payload = wire.decode_body(await req.body(), req.headers.get("content-type"), req.headers.get("content-encoding"))
+    except wire.UnsupportedEncoding as e:
+        return Response(str(e), status_code=415)
+    response = await _dispatch(req, payload)
+    body, headers = wire.encode_body(response, *wire.negotiate(req.headers.get("accept"), req.headers.get("accept-encoding")))
+    return Response(body, headers=headers)
+
+async def _dispatch(req: Request, payload: dict):
     method = payload.get("method")
     params = payload.get("params", {})
     _id = payload.get("id", 1)
@@ -62,21 +331,144 @@ async def jsonrpc(req: Request):
         inputs = params.get("inputs", {})
         logger.info(f"Calling tool: {tool} with inputs: {list(inputs.keys())}")
         
-        func = TOOLS.get(tool)
+        # Reject bad inputs (e.g. a literal "$prev.x" or a missing transcript) before any work
+        schema = tool_schemas().get(tool)
+        errors = schema.validate(inputs, "inputs") if schema else []
+        if errors:
+            logger.error(f"Invalid inputs for {tool}: {errors}")
+            return {"jsonrpc": "2.0", "error": {"message": f"Invalid inputs for {tool}: {'; '.join(errors)}", "invalid_inputs": errors}, "id": _id}
+        
+        try:
+            func = load_tool(tool)
+        except Exception as e:
+            logger.error(f"Failed to load tool {tool}: {e}", exc_info=True)
+            return {"jsonrpc": "2.0", "error": {"message": f"Failed to load tool: {str(e)}"}, "id": _id}
         if not func:
             logger.error(f"Tool not found: {tool}")
             return {"jsonrpc": "2.0", "error": {"message": "Tool not found"}, "id": _id}
         
+        request_id = params.get("request_id") or uuid.uuid4().hex
+        # "timeout" is the caller's remaining budget in seconds (relative, so host clocks need not agree)
+        timeout = params.get("timeout")
+        try:
+            requested = MAX_TOOL_SECONDS if timeout is None else float(timeout)
+            if isinstance(timeout, bool) or not math.isfinite(requested):
+                raise ValueError(timeout)
+            budget = min(requested, MAX_TOOL_SECONDS)
+        except (TypeError, ValueError):
+            logger.warning(f"Refusing {tool}: invalid timeout {timeout!r}")
+            return {"jsonrpc": "2.0", "error": {"message": "invalid timeout"}, "id": _id}
+        if budget <= 0:
+            logger.warning(f"Refusing {tool}: caller deadline already passed")
+            return {"jsonrpc": "2.0", "error": {"message": "Deadline already exceeded", "deadline_exceeded": True}, "id": _id}
+        ctx = RequestContext(request_id, deadline=time.monotonic() + budget)
+        # "profile": true asks for a cProfile/tracemalloc report of this one call
+        profile = None
+        if params.get("profile"):
+            if profiling.ENABLED:
+                profile = profiling.CallProfile(request_id, tool)
+            else:
+                logger.warning(f"Profiling requested for {tool} but MCP_PROFILING is off")
+        
+        # Interactive callers go first and each client gets its turn; a full queue answers "busy" at once
+        client_id = params.get("client_id") or req.headers.get("x-client-id") or client_ip
+        priority = params.get("priority") or req.headers.get("x-priority") or "interactive"
+        queued_at = time.monotonic()
+        # Registered while queued too, so a "cancel" reaches a call that has no slot yet
+        _active_requests[request_id] = ctx
+        try:
+            await _acquire_slot(req, ctx, client_id, priority)
+        except SchedulerBusy as e:
+            _active_requests.pop(request_id, None)
+            logger.warning(f"Rejecting {tool} from {client_id} ({priority}): queue full, retry after {e.retry_after}s")
+            return {"jsonrpc": "2.0", "error": {"message": str(e), "busy": True, "retry_after": e.retry_after}, "id": _id}
+        except DeadlineExceeded:
+            _active_requests.pop(request_id, None)
+            logger.warning(f"{tool} from {client_id} ({priority}) ran out of time after {budget:.0f}s in the queue")
+            return {"jsonrpc": "2.0", "error": {"message": "Deadline exceeded while queued", "deadline_exceeded": True}, "id": _id}
+        except RequestCancelled as e:
+            _active_requests.pop(request_id, None)
+            logger.warning(f"{tool} from {client_id} ({priority}) cancelled while queued: {ctx.reason}")
+            return {"jsonrpc": "2.0", "error": {"message": str(e), "cancelled": True}, "id": _id}
+        waited = time.monotonic() - queued_at
+        if waited > 1:
+            logger.info(f"{tool} from {client_id} ({priority}) waited {waited:.2f}s for a slot")
+        
         start_time = datetime.now()
         try:
-            result = func(**inputs)
+            result = await _run_tool(req, ctx, func, inputs, profile)
             elapsed = (datetime.now() - start_time).total_seconds()
             logger.info(f"Tool {tool} completed successfully in {elapsed:.2f}s")
-            return {"jsonrpc": "2.0", "result": result, "id": _id}
+            response = {"jsonrpc": "2.0", "result": result, "id": _id}
+            if profile is not None and not profile.captured:
+                logger.warning(f"Profile of {tool} skipped: another call was being profiled")
+            elif profile is not None:
+                # pstats/tracemalloc formatting and the report files stay off the event loop
+                response["profile"] = await asyncio.get_running_loop().run_in_executor(None, profile.report, result)
+                logger.info(f"Profile of {tool}: {response['profile']['seconds_by_category']} -> {response['profile']['report_url']}")
+            return response
+        except DeadlineExceeded as e:
+            elapsed = (datetime.now() - start_time).total_seconds()
+            logger.warning(f"Tool {tool} stopped after {elapsed:.2f}s (budget {budget:.0f}s): {str(e)}")
+            return {"jsonrpc": "2.0", "error": {"message": str(e), "deadline_exceeded": True}, "id": _id}
+        except RequestCancelled as e:
+            elapsed = (datetime.now() - start_time).total_seconds()
+            logger.warning(f"Tool {tool} cancelled after {elapsed:.2f}s: {ctx.reason}")
+            return {"jsonrpc": "2.0", "error": {"message": str(e), "cancelled": True}, "id": _id}
         except Exception as e:
             elapsed = (datetime.now() - start_time).total_seconds()
             logger.error(f"Tool {tool} failed after {elapsed:.2f}s: {str(e)}", exc_info=True)
             return {"jsonrpc": "2.0", "error": {"message": str(e)}, "id": _id}
+        finally:
+            _active_requests.pop(request_id, None)
+            _scheduler.release(priority, (datetime.now() - start_time).total_seconds())
+
+    if method == "validate_plan":
+        steps = params.get("plan", [])
+        errors = validate_plan(steps, tool_schemas())
+        logger.info(f"Validated plan of {len(steps)} steps: {len(errors)} errors")
+        return {"jsonrpc": "2.0", "result": {"valid": not errors, "errors": errors}, "id": _id}
+
+    if method in ("search", "lookup", "find_existing"):
+        # Library index of everything converted so far (see library.py)
+        try:
+            if method == "search":
+                result = get_library().search(params.get("query", ""), int(params.get("limit", 20)))
+            else:
+                from agents.transcript_agent import extract_video_id
+                video_id = extract_video_id(params.get("video", ""))
+                if method == "lookup":
+                    result = get_library().lookup(video_id, params.get("tone"))
+                else:
+                    result = get_library().find_existing(video_id, params.get("tone"), bool(params.get("need_diagram")))
+        except Exception as e:
+            logger.error(f"Library {method} failed: {e}")
+            return {"jsonrpc": "2.0", "error": {"message": f"Library {method} failed: {str(e)}"}, "id": _id}
+        return {"jsonrpc": "2.0", "result": result, "id": _id}
+
+    if method == "cancel":
+        request_id = params.get("request_id")
+        reason = params.get("reason", "cancelled by client")
+        ctx = _active_requests.get(request_id)
+        if ctx is not None:
+            ctx.cancel(reason)
+        else:
+            # The call may be running on another worker; it polls the shared cache
+            get_cache().set("cancel", request_id, reason, ttl=CANCEL_FLAG_TTL)
+        return {"jsonrpc": "2.0", "result": {"request_id": request_id, "found": ctx is not None}, "id": _id}
     
     logger.warning(f"Unknown method: {method}")
-    return {"jsonrpc": "2.0", "error": {"message": "Unknown method"}, "id": _id}
\ No newline at end of file
+    return {"jsonrpc": "2.0", "error": {"message": "Unknown method"}, "id": _id}
+
+if __name__ == "__main__":
+    # Multi-worker entry point: one worker per core unless MCP_WORKERS says otherwise.
+    # Equivalent to `uvicorn server:app --workers N` or `gunicorn -c gunicorn.conf.py server:app`.
+    import uvicorn
+    workers = int(os.getenv("MCP_WORKERS", os.cpu_count() or 1))
+    logger.info(f"Starting MCP server with {workers} workers, outputs in {OUTPUTS_DIR}")
+    uvicorn.run(
+        "server:app",
+        host=os.getenv("MCP_HOST", "0.0.0.0"),
+        port=int(os.getenv("MCP_PORT", "8000")),
+        workers=workers
+    )
@@ -0,0 +1,59 @@
+import os
+import uuid
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+
+# Get the directory where this file is located
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Shared locations. In multi-worker / multi-node deployments point these at a
+# volume that every worker (and the chatbot serving /download) can see.
+OUTPUTS_DIR = os.path.abspath(os.getenv("MCP_OUTPUTS_DIR", os.path.join(BASE_DIR, "outputs")))
+# SQLite is safe across the workers of one node; give every node the same path on
+# a shared volume only if that filesystem supports POSIX locking.
+CACHE_PATH = os.path.abspath(os.getenv("MCP_CACHE_PATH", os.path.join(BASE_DIR, ".cache", "cache.sqlite3")))
+# Searchable index of every transcript and blog the agents produced
+LIBRARY_PATH = os.path.abspath(os.getenv("MCP_LIBRARY_PATH", os.path.join(BASE_DIR, ".cache", "library.sqlite3")))
+LOG_DIR = os.path.abspath(os.getenv("MCP_LOG_DIR", "."))
+
+
+def output_path(filename: str) -> str:
+    """Absolute path of a file inside the shared outputs directory (nothing is created)."""
+    return os.path.join(OUTPUTS_DIR, filename)
+
+
+def output_url(filename: str) -> str:
+    """URL (relative to the server root) that /download understands."""
+    return f"outputs/{filename}"
+
+
+def unique_stem(prefix: str) -> str:
+    """
+    Timestamped file stem that cannot collide across workers.
+
+    A plain second-resolution timestamp is not enough once several processes
+    export at the same time, so a short random suffix is appended.
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{prefix}_{timestamp}_{uuid.uuid4().hex[:8]}"
+
+
+@contextmanager
+def atomic_output(filename: str):
+    """
+    Yield a temporary path in the outputs directory and move it into place on success.
+
+    Readers on other workers never observe a half-written file, which matters
+    when the outputs directory is shared storage.
+    """
+    final_path = output_path(filename)
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(final_path), prefix=".tmp-", suffix=os.path.splitext(filename)[1])
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, final_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
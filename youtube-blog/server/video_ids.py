@@ -0,0 +1,16 @@
+import re
+
+# A YouTube video ID in a watch, shorts, embed, live or youtu.be link; shared by
+# the server's TranscriptAgent and the client (imported as server.video_ids)
+VIDEO_ID_PATTERN = re.compile(r"(?:youtube\.com/(?:watch\?(?:\S*&)?v=|shorts/|embed/|live/)|youtu\.be/)([A-Za-z0-9_-]{11})")
+# A bare video ID; it also names the transcript file in the segment store
+BARE_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{11}")
+
+
+def video_id_of(video_url):
+    """YouTube video ID in a URL (or the string itself when it already is a bare ID), else None."""
+    video_url = (video_url or "").strip()
+    match = VIDEO_ID_PATTERN.search(video_url)
+    if match:
+        return match.group(1)
+    return video_url if BARE_ID_PATTERN.fullmatch(video_url) else None
@@ -0,0 +1,121 @@
+import gzip
+import json
+import os
+
+# Optional codecs; JSON without compression stays the default and always works
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_TYPE = "application/json"
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+# Small bodies (cancel, list_tools) are not worth the compression CPU
+MIN_COMPRESS_BYTES = int(os.getenv("MCP_MIN_COMPRESS_BYTES", "1024"))
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+
+
+class UnsupportedEncoding(ValueError):
+    """Raised for a request body in a content type or coding this process cannot read."""
+
+
+def content_codings() -> list:
+    """Codings this process can produce and read, most preferred first."""
+    return (["zstd"] if zstandard else []) + ["gzip"]
+
+
+def compress(data: bytes, coding: str) -> bytes:
+    if coding == "zstd" and zstandard:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if coding == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    raise UnsupportedEncoding(f"Unsupported content coding: {coding}")
+
+
+def decompress(data: bytes, coding: str) -> bytes:
+    if coding in (None, "", "identity"):
+        return data
+    if coding == "zstd" and zstandard:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    if coding == "gzip":
+        return gzip.decompress(data)
+    raise UnsupportedEncoding(f"Unsupported content coding: {coding}")
+
+
+def dumps(obj, content_type: str = JSON_TYPE) -> bytes:
+    if content_type in MSGPACK_TYPES:
+        return msgpack.packb(obj, use_bin_type=True)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: bytes, content_type: str = JSON_TYPE):
+    if content_type in MSGPACK_TYPES:
+        if msgpack is None:
+            raise UnsupportedEncoding("msgpack is not installed")
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+def decode_body(body: bytes, content_type: str = None, content_encoding: str = None):
+    media_type = (content_type or JSON_TYPE).split(";")[0].strip().lower()
+    return loads(decompress(body, (content_encoding or "").strip().lower()), media_type)
+
+
+def accepted_qualities(header: str) -> dict:
+    """An Accept / Accept-Encoding header as {name: q}; q=0 refuses a name, "*" stands for any unlisted one."""
+    accepted = {}
+    for item in (header or "").split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def preferred(offered, header: str):
+    """
+    The entry of ``offered`` the header ranks highest, or None when it accepts none of them.
+
+    Ties go to the earlier entry, so ``offered`` is the server's own order of
+    preference. Also used by the chatbot's /download for precompressed files.
+    """
+    accepted = accepted_qualities(header)
+    best, best_q = None, 0.0
+    for name in offered:
+        q = accepted.get(name, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def negotiate(accept: str = None, accept_encoding: str = None):
+    """Pick the response (content type, coding or None) from the request's Accept headers."""
+    content_type = JSON_TYPE
+    if msgpack is not None:
+        # msgpack only when the client names it; JSON is what "*/*" and no header get
+        content_type = preferred(MSGPACK_TYPES + (JSON_TYPE,), accept) or JSON_TYPE
+    return content_type, preferred(content_codings(), accept_encoding)
+
+
+def encode_body(obj, content_type: str = JSON_TYPE, coding: str = None):
+    """Serialize (and compress, if worth it) a response body. Returns (bytes, headers)."""
+    data = dumps(obj, content_type)
+    headers = {"Content-Type": content_type, "Vary": "Accept, Accept-Encoding"}
+    if coding and len(data) >= MIN_COMPRESS_BYTES:
+        data = compress(data, coding)
+        headers["Content-Encoding"] = coding
+    return data, headers
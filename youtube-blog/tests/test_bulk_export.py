@@ -0,0 +1,63 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+from starlette.requests import ClientDisconnect
+
+# The server is run from server/ and imports its modules by bare name
+SERVER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server")
+sys.path.insert(0, SERVER_DIR)
+_tmp = tempfile.mkdtemp(prefix="youtube-blog-test-")
+for name, value in (("MCP_LOG_DIR", _tmp), ("MCP_OUTPUTS_DIR", os.path.join(_tmp, "outputs")),
+                    ("MCP_CACHE_PATH", os.path.join(_tmp, "cache.sqlite3")),
+                    ("MCP_LIBRARY_PATH", os.path.join(_tmp, "library.sqlite3")), ("MCP_PREWARM", "0")):
+    os.environ.setdefault(name, value)
+
+import server  # noqa: E402
+
+
+def _export(connected: bool) -> list:
+    """
+    POST /export for one markdown-only blog straight through the ASGI app; returns the messages sent.
+
+    When not ``connected`` the client is gone by the time the response starts,
+    so sending it fails before the first chunk is produced.
+    """
+    body = json.dumps({"blogs": [{"blog_markdown": "# Title\n\nText"}], "include": ["md"]}).encode()
+    scope = {"type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+             "method": "POST", "scheme": "http", "path": "/export", "raw_path": b"/export", "root_path": "",
+             "query_string": b"", "headers": [(b"content-type", b"application/json")],
+             "client": ("127.0.0.1", 1234), "server": ("testserver", 80)}
+    received = []
+    sent = []
+
+    async def receive():
+        if not received:
+            received.append(True)
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        if not connected:
+            raise OSError("connection reset by peer")
+        sent.append(message)
+
+    try:
+        asyncio.run(server.app(scope, receive, send))
+    except ClientDisconnect:
+        assert not connected
+    return sent
+
+
+def test_disconnect_before_first_chunk_releases_slot():
+    assert _export(connected=False) == []
+    assert server._scheduler.running["batch"] == 0
+
+
+def test_finished_export_releases_slot():
+    sent = _export(connected=True)
+    assert sent[0]["status"] == 200
+    assert b"".join(m.get("body", b"") for m in sent[1:]).startswith(b"PK")
+    assert server._scheduler.running["batch"] == 0